@@ -0,0 +1,4 @@
+from asgiref.wsgi import WsgiToAsgi  # pip install asgiref uvicorn
+from flaskblog import create_app
+
+app = WsgiToAsgi(create_app())  # uvicorn asgi:app --workers 4. the sync views as run.py serves them, each on a thread
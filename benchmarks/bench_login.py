@@ -0,0 +1,104 @@
+"""Login throughput under concurrent load, with bcrypt inline vs on the bounded hashing pool.
+
+Runs a burst of concurrent logins against a throwaway SQLite database while one extra thread keeps
+requesting a cheap page, so the numbers show both how fast logins go and how much they starve
+everything else. Run from the repository root:
+
+    python benchmarks/bench_login.py --threads 16 --logins 200 --rounds 10
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from common import make_app, percentile
+from flaskblog import db, bcrypt
+from flaskblog.models import User
+
+PASSWORD = 'correct horse battery staple'
+
+
+def seed(app, users, rounds):
+    with app.app_context():
+        db.create_all()
+        pw_hash = bcrypt.generate_password_hash(PASSWORD, rounds).decode('utf-8')  # one hash, every user
+        db.session.bulk_insert_mappings(User, [dict(username=f'user{i}', email=f'user{i}@example.com',
+                                                    password=pw_hash) for i in range(users)])
+        db.session.commit()
+
+
+def run(app, threads, logins, users):
+    login_times, page_times, failures = [], [], []
+    remaining = [logins]
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def login_worker(worker):
+        client = app.test_client()
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+                n = remaining[0]
+            email = f'user{(worker * 7919 + n) % users}@example.com'
+            started = time.perf_counter()
+            response = client.post('/login', data={'email': email, 'password': PASSWORD})
+            elapsed = time.perf_counter() - started
+            with lock:
+                if response.status_code == 302:
+                    login_times.append(elapsed)
+                else:
+                    failures.append(response.status_code)
+            client.get('/logout')
+
+    def page_worker():  # a reader who just wants the about page while everybody else logs in
+        client = app.test_client()
+        while not done.is_set():
+            started = time.perf_counter()
+            client.get('/about')
+            page_times.append(time.perf_counter() - started)
+
+    workers = [threading.Thread(target=login_worker, args=(i,)) for i in range(threads)]
+    reader = threading.Thread(target=page_worker)
+    started = time.perf_counter()
+    reader.start()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    wall = time.perf_counter() - started
+    done.set()
+    reader.join()
+    return dict(logins_per_second=len(login_times) / wall,
+                login_p50_ms=percentile(login_times, 50) * 1000, login_p95_ms=percentile(login_times, 95) * 1000,
+                page_p50_ms=percentile(page_times, 50) * 1000, page_p95_ms=percentile(page_times, 95) * 1000,
+                pages=len(page_times), failures=len(failures))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16, help='concurrent login clients')
+    parser.add_argument('--logins', type=int, default=200, help='total logins per mode')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--rounds', type=int, default=10, help='bcrypt cost factor')
+    parser.add_argument('--pool', type=int, default=os.cpu_count() or 1, help='BCRYPT_MAX_CONCURRENCY for the pool run')
+    args = parser.parse_args()
+
+    print(f'{args.logins} logins, {args.threads} client threads, bcrypt cost {args.rounds}')
+    print(f'{"mode":<14}{"logins/s":>10}{"login p50":>11}{"login p95":>11}{"page p50":>10}{"page p95":>10}'
+          f'{"pages":>8}{"failed":>8}')
+    for mode, concurrency in (('inline', 0), (f'pool({args.pool})', args.pool)):
+        with tempfile.TemporaryDirectory() as tmp:
+            app = make_app(os.path.join(tmp, 'bench.db'), BCRYPT_LOG_ROUNDS=args.rounds,
+                           BCRYPT_MAX_CONCURRENCY=concurrency, BCRYPT_MAX_QUEUE=1024)
+            seed(app, args.users, args.rounds)
+            result = run(app, args.threads, args.logins, args.users)
+        print(f'{mode:<14}{result["logins_per_second"]:>10.1f}{result["login_p50_ms"]:>9.1f}ms'
+              f'{result["login_p95_ms"]:>9.1f}ms{result["page_p50_ms"]:>8.1f}ms{result["page_p95_ms"]:>8.1f}ms'
+              f'{result["pages"]:>8}{result["failures"]:>8}')
+
+
+if __name__ == '__main__':
+    main()
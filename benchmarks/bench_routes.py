@@ -0,0 +1,210 @@
+"""Latency, throughput and queries per request for every public route, saved as JSON.
+
+Builds a seeded synthetic database, then drives each route twice: one at a time through the Flask test
+client (clean per-route latency and query counts), and from concurrent clients over real HTTP against a
+threaded server (throughput and latency under load). Compare two runs with compare.py:
+
+    python benchmarks/bench_routes.py --output before.json
+    ... change something ...
+    python benchmarks/bench_routes.py --output after.json
+    python benchmarks/compare.py before.json after.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from urllib.parse import quote_plus
+from datetime import datetime
+
+from werkzeug.serving import make_server
+
+from common import make_app, summarize, git_revision
+from datagen import generate, PASSWORD
+from flaskblog import db
+from flaskblog.models import User, Post, Pattern, Section
+from flaskblog.pagination import encode_cursor
+
+# routes that need a login or change data are not part of the read benchmark. any rule that is neither
+# sampled nor listed here is reported, so new routes don't silently go unmeasured
+SKIPPED = {'posts.new_post', 'posts.update_post', 'posts.delete_post', 'users.account', 'users.logout',
+           'users.reset_token', 'patterns.new_pattern', 'patterns.new_section', 'patterns.update_pattern',
+           'patterns.update_section', 'patterns.delete_pattern', 'patterns.delete_section', 'users.avatar',
+           'static', 'assets'}
+
+
+def sample_urls(app, per_route, seed):  # {label: [urls]}, the same urls for the same database and seed
+    rng = random.Random(seed)
+    with app.app_context():
+        post_ids = [i for i, in db.session.query(Post.id)]
+        usernames = [u for u, in db.session.query(User.username)]
+        slugs = [s for s, in db.session.query(Pattern.slug)]
+        sections = db.session.query(Section.id, Pattern.slug).join(Pattern, Pattern.id == Section.pattern_id).all()
+        middle = db.session.query(Post.date_posted, Post.id).order_by(Post.date_posted.desc(), Post.id.desc()) \
+            .offset(len(post_ids) // 2).first()
+
+    def pick(values, n=per_route):
+        return [rng.choice(values) for _ in range(n)] if values else []
+
+    deep = encode_cursor('next', list(middle)) if middle else ''
+    urls = {
+        'main.home': ['/'] * per_route,
+        'main.home (deep cursor)': [f'/?cursor={deep}'] * per_route,
+        'main.about': ['/about'] * per_route,
+        'main.popular': ['/popular'] * per_route,
+        'posts.post': [f'/post/{i}' for i in pick(post_ids)],
+        'users.user_posts': [f'/user/{u}' for u in pick(usernames)],
+        'users.login': ['/login'] * per_route,
+        'users.register': ['/register'] * per_route,
+        'users.reset_request': ['/reset_password'] * per_route,
+        'patterns.index': ['/patterns'] * per_route,
+        'patterns.pattern': [f'/patterns/{s}' for s in pick(slugs)],
+        'patterns.section': [f'/patterns/{slug}/{i}' for i, slug in pick(sections)],
+        'patterns.section_bodies': [f'/patterns/{slug}/sections.json?ids={i}' for i, slug in pick(sections)],
+        'search.results': [f'/search?q={quote_plus(q)}' for q in pick(['mind', 'habit', 'morning routine', 'calm'])],
+    }
+    return {label: values for label, values in urls.items() if values}
+
+
+def unmeasured(app, labels):  # flask-admin is admin only, so it's left out as a whole
+    covered = {label.split(' ')[0] for label in labels}
+    admin_urls = tuple(admin.url for admin in app.extensions.get('admin', ()))
+    return sorted({rule.endpoint for rule in app.url_map.iter_rules()
+                   if rule.endpoint not in covered and rule.endpoint not in SKIPPED
+                   and not (admin_urls and rule.rule.startswith(admin_urls))})
+
+
+def run_client(app, urls, warmup):  # sequential, in-process: per-route latency and queries per request
+    client = app.test_client()
+    results = {}
+    for label, route_urls in urls.items():
+        for url in route_urls[:warmup]:
+            client.get(url)
+        latencies, queries, errors = [], [], 0
+        for url in route_urls:
+            started = time.perf_counter()
+            response = client.get(url)
+            latencies.append(time.perf_counter() - started)
+            queries.append(int(response.headers.get('X-Query-Count', 0)))
+            errors += response.status_code >= 400
+        results[label] = dict(summarize(latencies), queries_per_request=sum(queries) / len(queries), errors=errors)
+
+    latencies = []  # logging in is the one write worth tracking: it is all bcrypt
+    for i in range(max(len(next(iter(urls.values()))) // 5, 5)):
+        client.get('/logout')
+        started = time.perf_counter()
+        response = client.post('/login', data=dict(email=f'user{i % 5 + 1}@example.com', password=PASSWORD))
+        latencies.append(time.perf_counter() - started)
+        if response.status_code != 302:
+            raise SystemExit(f'login failed with {response.status_code}, the benchmark data is broken')
+    results['users.login (POST)'] = dict(summarize(latencies), queries_per_request=None, errors=0)
+    return results
+
+
+def run_http(app, urls, concurrency, duration):  # concurrent clients against a threaded server
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    base = f'http://127.0.0.1:{server.server_port}'
+    serving = threading.Thread(target=server.serve_forever, daemon=True)
+    serving.start()
+    work = [(label, url) for label, route_urls in urls.items() for url in route_urls]
+    per_label = {label: [] for label in urls}
+    errors = {label: 0 for label in urls}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(worker):
+        rng = random.Random(worker)
+        while time.perf_counter() < deadline:
+            label, url = rng.choice(work)
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(base + url) as response:
+                    response.read()
+                failed = False
+            except (urllib.error.URLError, ConnectionError):
+                failed = True
+            elapsed = time.perf_counter() - started
+            with lock:
+                if failed:
+                    errors[label] += 1
+                else:
+                    per_label[label].append(elapsed)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    wall = time.perf_counter() - started
+    server.shutdown()
+    everything = [t for latencies in per_label.values() for t in latencies]
+    routes = {label: dict(summarize(latencies, wall), errors=errors[label])
+              for label, latencies in per_label.items() if latencies}
+    return dict(total=dict(summarize(everything, wall), errors=sum(errors.values())), routes=routes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--posts', type=int, default=5000)
+    parser.add_argument('--patterns', type=int, default=50)
+    parser.add_argument('--sections', type=int, default=10, help='per pattern')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--requests', type=int, default=50, help='test client requests per route')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=8, help='http clients, 0 skips the http run')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of http load')
+    parser.add_argument('--cache', default='null', help="CACHE_TYPE during the run, 'null' measures real work")
+    parser.add_argument('--output', default=None, help='json file, default benchmarks/results/<time>.json')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, 'bench.db'), CACHE_TYPE=args.cache, SQL_QUERY_STATS_HEADERS=True,
+                       BCRYPT_LOG_ROUNDS=4)
+        print(f'Generating {args.posts} posts, {args.patterns} patterns x {args.sections} sections...', file=sys.stderr)
+        with app.app_context():
+            db.create_all()
+            counts = generate(users=args.users, posts=args.posts, patterns=args.patterns, sections=args.sections,
+                              seed=args.seed)
+        urls = sample_urls(app, args.requests, args.seed)
+        missing = unmeasured(app, urls)
+        if missing:
+            print(f'Not benchmarked: {", ".join(missing)}', file=sys.stderr)
+        print('Test client run...', file=sys.stderr)
+        client_results = run_client(app, urls, args.warmup)
+        http_results = None
+        if args.concurrency:
+            print(f'HTTP run, {args.concurrency} clients for {args.duration:.0f}s...', file=sys.stderr)
+            http_results = run_http(app, urls, args.concurrency, args.duration)
+        app.extensions['view_counter'].flush(app)  # now, while the database still exists, rather than at exit
+
+    result = dict(meta=dict(created=datetime.utcnow().isoformat(), revision=git_revision(),
+                            python=platform.python_version(), platform=platform.platform(),
+                            args=vars(args), data=counts),
+                  client=client_results, http=http_results)
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results',
+                                         datetime.utcnow().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+
+    print(f'{"route":<32}{"p50":>9}{"p95":>9}{"p99":>9}{"queries":>9}')
+    for label, r in client_results.items():
+        queries = '-' if r['queries_per_request'] is None else f'{r["queries_per_request"]:.1f}'
+        print(f'{label:<32}{r["p50_ms"]:>7.1f}ms{r["p95_ms"]:>7.1f}ms{r["p99_ms"]:>7.1f}ms{queries:>9}')
+    if http_results:
+        total = http_results['total']
+        print(f'http: {total["rps"]:.0f} req/s, p50 {total["p50_ms"]:.1f}ms, p95 {total["p95_ms"]:.1f}ms, '
+              f'p99 {total["p99_ms"]:.1f}ms, {total["errors"]} errors')
+    print(f'Saved {output}')
+
+
+if __name__ == '__main__':
+    main()
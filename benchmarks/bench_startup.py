@@ -0,0 +1,90 @@
+"""Cold start: import time, create_app() time and first request latency, each in a fresh interpreter.
+
+Every sample is a new python process, so nothing is warm except the OS file cache. Runs the default
+configuration and the lazy variants side by side and saves the numbers as JSON:
+
+    python benchmarks/bench_startup.py --runs 10 --output startup.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+from common import summarize, git_revision
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+VARIANTS = {  # name -> environment for the child process
+    'default': {},
+    'no admin': dict(ADMIN_ENABLED='0'),
+    'no admin, precompiled': dict(ADMIN_ENABLED='0', TEMPLATES_PRECOMPILE='1'),
+    'admin, precompiled': dict(TEMPLATES_PRECOMPILE='1'),
+}
+
+# runs in the child. prints one json line: seconds spent importing, in create_app() and on the first request
+CHILD = '''
+import json, sys, time
+started = time.perf_counter()
+import flaskblog
+from flaskblog.config import Config
+imported = time.perf_counter()
+app = flaskblog.create_app(type('StartupConfig', (Config,), dict(SQLALCHEMY_TRACK_MODIFICATIONS=False)))
+created = time.perf_counter()
+with app.app_context():
+    flaskblog.db.create_all()
+created_db = time.perf_counter()
+response = app.test_client().get('/')
+finished = time.perf_counter()
+if response.status_code != 200:
+    sys.exit(f'GET / answered {response.status_code}')
+print(json.dumps(dict(import_s=imported - started, create_app_s=created - imported,
+                      first_request_s=finished - created_db, modules=len(sys.modules))))
+'''
+
+
+def sample(env):
+    output = subprocess.check_output([sys.executable, '-c', CHILD], cwd=ROOT, env=env)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10, help='fresh processes per variant')
+    parser.add_argument('--variant', action='append', choices=sorted(VARIANTS), help='default: all of them')
+    parser.add_argument('--output', default=None, help='json file, default benchmarks/results/startup-<time>.json')
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        base = dict(os.environ, SECRET_KEY='bench', SQLALCHEMY_DATABASE_URI=f'sqlite:///{tmp}/startup.db',
+                    MAIL_OUTBOX_WORKER='none', CACHE_TYPE='null')
+        for name in args.variant or VARIANTS:
+            print(f'{name}...', file=sys.stderr)
+            runs = [sample(dict(base, **VARIANTS[name])) for _ in range(args.runs)]
+            results[name] = {'import': summarize([r['import_s'] for r in runs]),
+                             'create_app': summarize([r['create_app_s'] for r in runs]),
+                             'boot': summarize([r['import_s'] + r['create_app_s'] for r in runs]),
+                             'first_request': summarize([r['first_request_s'] for r in runs]),
+                             'modules': runs[-1]['modules']}
+
+    result = dict(meta=dict(created=datetime.utcnow().isoformat(), revision=git_revision(),
+                            python=platform.python_version(), platform=platform.platform(), args=vars(args)),
+                  startup=results)
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results',
+                                         'startup-' + datetime.utcnow().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+
+    print(f'{"variant":<26}{"import":>10}{"create_app":>12}{"boot":>10}{"1st request":>13}{"modules":>9}')
+    for name, r in results.items():
+        print(f'{name:<26}{r["import"]["p50_ms"]:>8.0f}ms{r["create_app"]["p50_ms"]:>10.0f}ms'
+              f'{r["boot"]["p50_ms"]:>8.0f}ms{r["first_request"]["p50_ms"]:>11.1f}ms{r["modules"]:>9}')
+    print(f'Saved {output}')
+
+
+if __name__ == '__main__':
+    main()
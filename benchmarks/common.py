@@ -0,0 +1,41 @@
+"""Shared helpers for the benchmark scripts: a throwaway app and latency statistics."""
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from flaskblog import create_app  # noqa: E402
+from flaskblog.config import Config  # noqa: E402
+
+
+def make_app(db_path, **overrides):  # a create_app() on its own sqlite file, with background workers off
+    settings = dict(SECRET_KEY='bench', SQLALCHEMY_DATABASE_URI=f'sqlite:///{db_path}',
+                    SQLALCHEMY_TRACK_MODIFICATIONS=False, WTF_CSRF_ENABLED=False, CACHE_TYPE='null',
+                    MAIL_OUTBOX_WORKER='none')
+    settings.update(overrides)
+    return create_app(type('BenchConfig', (Config,), settings))
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def summarize(latencies, wall=None):  # seconds in, milliseconds out
+    summary = dict(n=len(latencies), mean_ms=sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+                   p50_ms=percentile(latencies, 50) * 1000, p95_ms=percentile(latencies, 95) * 1000,
+                   p99_ms=percentile(latencies, 99) * 1000)
+    if wall:
+        summary['rps'] = len(latencies) / wall
+    return summary
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,75 @@
+"""Compare two bench_routes.py result files and flag regressions.
+
+    python benchmarks/compare.py before.json after.json --threshold 10
+
+Exits with status 1 when any route got slower than the threshold at p50 or p95, or runs more queries.
+"""
+import argparse
+import json
+import sys
+
+METRICS = ('p50_ms', 'p95_ms')
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def rows(result):  # (section, label) -> stats, for both the test client and the http run
+    out = {('client', label): stats for label, stats in result['client'].items()}
+    if result.get('http'):
+        out[('http', 'total')] = result['http']['total']
+        out.update({('http', label): stats for label, stats in result['http']['routes'].items()})
+    return out
+
+
+def compare(before, after, threshold, min_ms):  # returns (lines, regressions)
+    old, new = rows(before), rows(after)
+    lines, regressions = [], []
+    for key in sorted(set(old) & set(new)):
+        a, b = old[key], new[key]
+        cells, flagged = [], []
+        for metric in METRICS:
+            change = (b[metric] - a[metric]) / a[metric] * 100 if a[metric] else 0.0
+            cells.append(f'{a[metric]:>8.1f} {b[metric]:>8.1f} {change:>+6.0f}%')
+            if change > threshold and b[metric] - a[metric] > min_ms:  # ignore noise on sub-millisecond routes
+                flagged.append(f'{metric} +{change:.0f}%')
+        if a.get('queries_per_request') is not None and b.get('queries_per_request') is not None \
+                and b['queries_per_request'] > a['queries_per_request']:
+            flagged.append(f"queries {a['queries_per_request']:.1f} -> {b['queries_per_request']:.1f}")
+        if 'rps' in a and 'rps' in b and a['rps'] and (a['rps'] - b['rps']) / a['rps'] * 100 > threshold:
+            flagged.append(f"rps {a['rps']:.0f} -> {b['rps']:.0f}")
+        label = f'{key[0]}:{key[1]}'
+        lines.append(f'{label:<40}' + '  '.join(cells) + ('  REGRESSION ' + ', '.join(flagged) if flagged else ''))
+        if flagged:
+            regressions.append(label)
+    for key in sorted(set(old) ^ set(new)):
+        lines.append(f'{key[0]}:{key[1]:<33} only in {"before" if key in old else "after"}')
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=10, help='percent slower before a route is flagged')
+    parser.add_argument('--min-ms', type=float, default=0.5, help='absolute change below which nothing is flagged')
+    args = parser.parse_args()
+    before, after = load(args.before), load(args.after)
+    for name, result in (('before', before), ('after', after)):
+        meta = result['meta']
+        print(f"{name}: {meta['created']} revision {meta['revision']} python {meta['python']}")
+    if before['meta']['data'] != after['meta']['data']:
+        print('warning: the runs used different data sizes, the numbers are not comparable')
+    print(f'{"":<40}{"p50 before/after/change":>25}  {"p95 before/after/change":>25}')
+    lines, regressions = compare(before, after, args.threshold, args.min_ms)
+    print('\n'.join(lines))
+    if regressions:
+        print(f'{len(regressions)} regressions')
+        sys.exit(1)
+    print('No regressions.')
+
+
+if __name__ == '__main__':
+    main()
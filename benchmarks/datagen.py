@@ -0,0 +1,103 @@
+"""Seeded synthetic data: the same arguments always produce the same database.
+
+Used by the other benchmarks, or on its own to fill a database for poking around:
+
+    python benchmarks/datagen.py /tmp/bench.db --users 200 --posts 20000 --patterns 100 --sections 20
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+
+from common import make_app
+from flaskblog import db, bcrypt
+from flaskblog.models import User, Post, Pattern, Section
+from flaskblog.patterns.utils import slugify
+from flaskblog.rendering import rendered_fields
+
+PASSWORD = 'correct horse battery staple'
+WORDS = ('mind', 'habit', 'morning', 'thought', 'calm', 'focus', 'change', 'pattern', 'growth', 'fear', 'sleep',
+         'energy', 'routine', 'kindness', 'anger', 'reading', 'walk', 'breath', 'doubt', 'goal', 'trust', 'plan')
+EPOCH = datetime(2020, 1, 1)  # fixed, so dates (and cursors) are identical across runs
+
+
+def sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def paragraph(rng, size):  # roughly `size` characters of text
+    parts, length = [], 0
+    while length < size:
+        parts.append(sentence(rng, rng.randint(6, 14)) + '.')
+        length += len(parts[-1]) + 1
+    return ' '.join(parts)
+
+
+def generate(users=50, posts=2000, patterns=50, sections=10, seed=1, rounds=4, chunk_size=5000):
+    # call inside an app context on an empty database. returns the counts written
+    rng = random.Random(seed)
+    pw_hash = bcrypt.generate_password_hash(PASSWORD, rounds).decode('utf-8')  # one hash for everybody
+    db.session.bulk_insert_mappings(User, [
+        dict(id=i, username=f'user{i}', email=f'user{i}@example.com', password=pw_hash,
+             role='admin' if i == 1 else 'user') for i in range(1, users + 1)])
+    db.session.commit()
+
+    for start in range(0, posts, chunk_size):
+        rows = []
+        for i in range(start, min(start + chunk_size, posts)):
+            title = sentence(rng, rng.randint(2, 6))  # drawn in the same order as before, same data per seed
+            content = paragraph(rng, rng.randint(200, 2000))
+            rows.append(dict(id=i + 1, title=title, content=content,
+                             user_id=rng.randint(1, users), date_posted=EPOCH + timedelta(minutes=i * 37),
+                             updated_at=EPOCH + timedelta(minutes=i * 37), **rendered_fields(content)))
+        db.session.bulk_insert_mappings(Post, rows)
+        db.session.commit()
+
+    rows = []
+    for i in range(1, patterns + 1):
+        title = f'{sentence(rng, 3)} {i}'
+        content = paragraph(rng, 300)
+        rows.append(dict(id=i, position=i, title=title, slug=slugify(f'pattern {i}'), content=content,
+                         updated_at=EPOCH, **rendered_fields(content)))
+    db.session.bulk_insert_mappings(Pattern, rows)
+    db.session.commit()
+    rows = []
+    for pattern_id in range(1, patterns + 1):
+        for n in range(sections):
+            title = sentence(rng, 3)
+            content = paragraph(rng, rng.randint(500, 5000))
+            rows.append(dict(pattern_id=pattern_id, title=title, content=content, updated_at=EPOCH,
+                             **rendered_fields(content)))
+        if len(rows) >= chunk_size:
+            db.session.bulk_insert_mappings(Section, rows)
+            db.session.commit()
+            rows = []
+    if rows:
+        db.session.bulk_insert_mappings(Section, rows)
+        db.session.commit()
+    return dict(users=users, posts=posts, patterns=patterns, sections=patterns * sections)
+
+
+def build(db_path, **counts):  # create the schema and the data in a fresh sqlite file
+    app = make_app(db_path)
+    with app.app_context():
+        db.create_all()
+        generate(**counts)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('db_path')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--posts', type=int, default=2000)
+    parser.add_argument('--patterns', type=int, default=50)
+    parser.add_argument('--sections', type=int, default=10, help='per pattern')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    build(args.db_path, users=args.users, posts=args.posts, patterns=args.patterns, sections=args.sections,
+          seed=args.seed)
+    print(f'Wrote {args.db_path}')
+
+
+if __name__ == '__main__':
+    main()
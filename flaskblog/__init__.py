@@ -1,42 +1,88 @@
+import os
+import click
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
-from flask_admin import Admin
-from flask_principal import Principal
 from flask_mail import Mail
+from jinja2 import FileSystemBytecodeCache
 from flaskblog.config import Config
+from flaskblog.database import RoutingSQLAlchemy
+from flaskblog.querystats import QueryStats
+from flaskblog.cache import PageCache
+from flaskblog.assets import StaticAssets
+from flaskblog.compression import Compressor
+from flaskblog.metrics import Metrics
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()  # GET requests read from replicas when DB_REPLICA_URIS is set
 bcrypt = Bcrypt()
 login_manager = LoginManager()
 login_manager.login_view = 'users.login'  # additional things the user can see when logged in
 login_manager.login_message_category = 'info'
 mail = Mail()
-admin = Admin()
-principals = Principal()
+query_stats = QueryStats()
+page_cache = PageCache()
+assets = StaticAssets()
+compressor = Compressor()
+metrics = Metrics()
 
 
 def create_app(config_class=Config):
     app = Flask(__name__)
-    app.config.from_object(Config)
+    app.config.from_object(config_class)
 
     db.init_app(app)
+    if app.config['MIGRATE_ENABLED'] or click.get_current_context(silent=True) is not None:
+        from flask_migrate import Migrate  # pulls in alembic, which only `flask db ...` needs
+        Migrate(app, db, directory=os.path.join(os.path.dirname(app.root_path), 'migrations'),
+                render_as_batch=True)  # batch mode lets alembic alter tables on sqlite
     bcrypt.init_app(app)
     login_manager.init_app(app)
     mail.init_app(app)
-    admin.init_app(app)
-    principals.init_app(app)
+    query_stats.init_app(app)
+    page_cache.init_app(app)
+    assets.init_app(app)
+    compressor.init_app(app)
+    metrics.init_app(app)
 
     from flaskblog.users.routes import users
     from flaskblog.posts.routes import posts
     from flaskblog.main.routes import main  # Can't put these up top or it creates circular import logic
     from flaskblog.patterns.routes import patterns
     from flaskblog.errors.handlers import errors
+    from flaskblog.search.routes import search
+    from flaskblog.search.index import search_index
+    search_index.init_app(app)
+    from flaskblog.outbox import outbox
+    outbox.init_app(app)
+    from flaskblog.users.passwords import hasher
+    hasher.init_app(app)
+    from flaskblog.counters import view_counter
+    view_counter.init_app(app)
+    from flaskblog.patterns.catalogue import catalogue
+    catalogue.init_app(app)
+    from flaskblog.models import user_cache
+    user_cache.max_entries = app.config.get('USER_CACHE_SIZE', 4096)
+    from flaskblog.bulk import data_cli
+    app.cli.add_command(data_cli)
+    from flaskblog.rendering import content_cli, content_html
+    app.cli.add_command(content_cli)
+    app.add_template_filter(content_html)  # {{ post|content_html }}: the html stored when the post was saved
     app.register_blueprint(users)
     app.register_blueprint(posts)
     app.register_blueprint(main)
     app.register_blueprint(patterns)
+    app.register_blueprint(search)
     app.register_blueprint(errors)
+    if app.config['ADMIN_ENABLED']:  # web workers that never serve /admin skip importing flask_admin
+        from flaskblog.admin_views import admin
+        admin.init_app(app)
+    if app.config['PRINCIPAL_ENABLED']:
+        from flask_principal import Principal
+        Principal(app)
+    if app.config['TEMPLATES_BYTECODE_CACHE']:  # compiled templates shared by every worker and restart
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATES_BYTECODE_CACHE'])
+    if app.config['TEMPLATES_PRECOMPILE']:  # compile ours at boot instead of on each one's first request
+        for name in app.jinja_loader.list_templates():
+            app.jinja_env.get_template(name)
 
     return app
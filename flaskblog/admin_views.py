@@ -0,0 +1,202 @@
+from datetime import datetime
+from flask import abort, flash, g, redirect, request, url_for
+from flask_admin import Admin, AdminIndexView
+from flask_admin.actions import action
+from flask_admin.contrib.sqla import ModelView
+from flask_login import current_user
+from sqlalchemy import and_, func, or_, text
+from sqlalchemy.orm import contains_eager, joinedload, load_only
+from flaskblog import db, page_cache
+from flaskblog.models import User, Post, Pattern, invalidate_user
+from flaskblog.pagination import keyset_paginate
+from flaskblog.patterns.catalogue import catalogue
+from flaskblog.patterns.routes import pattern_tag
+from flaskblog.rendering import render_content
+from flaskblog.search.index import search_index
+
+
+TABLE_ESTIMATES = {  # the planner's row count, read when counting exactly would mean scanning the table
+    'postgresql': 'SELECT reltuples::bigint FROM pg_class WHERE relname = :table',
+    'mysql': 'SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = :table',
+}
+
+
+class AdminOnly:  # every page under /admin, the index included, is for users with the admin role
+    def is_accessible(self):
+        return current_user.is_authenticated and current_user.role == 'admin'
+
+    def inaccessible_callback(self, name, **kwargs):
+        if not current_user.is_authenticated:
+            return redirect(url_for('users.login', next=request.url))
+        abort(403)
+
+
+class AdminIndex(AdminOnly, AdminIndexView):
+    pass
+
+
+admin = Admin(index_view=AdminIndex())  # imported only when ADMIN_ENABLED, flask_admin and its sqla contrib load slowly
+
+
+class UserView(AdminOnly, ModelView):  # admin edits must drop the cached copy of the user
+    def after_model_change(self, form, model, is_created):
+        invalidate_user(model.id)
+
+    def after_model_delete(self, model):
+        invalidate_user(model.id)
+
+
+class KeysetModelView(AdminOnly, ModelView):  # list pages that cost the same on page 1000 as on page 1, and never COUNT(*)
+    list_template = 'admin/keyset_list.html'
+    simple_list_pager = True  # flask-admin's exact count is replaced by row_estimate()
+    column_auto_select_related = False  # list_columns below says exactly what to load
+    page_size = 50
+    keyset_columns = ()  # the default order, newest first. must match an index
+    list_columns = ()  # loaded for the list, long text columns stay in the database
+    search_columns = ()  # indexed string columns, searched by prefix
+    search_join = None  # relationship to join for search_columns on another table
+    count_limit = 10000  # rows counted exactly before we settle for an estimate
+
+    def init_search(self):
+        return bool(self.search_columns)
+
+    def search_placeholder(self):
+        return 'Starts with: ' + ', '.join(column.key for column in self.search_columns)
+
+    def _apply_search(self, query, count_query, joins, count_joins, search):
+        # a prefix is a range the index can answer, flask-admin's ILIKE '%term%' reads every row
+        if self.search_join is not None:
+            query = query.join(self.search_join)
+        for term in search.split():
+            clauses = [and_(column >= term, column < term + '\uffff') for column in self.search_columns]
+            if term.isdigit():
+                clauses.append(self.model.id == int(term))
+            query = query.filter(or_(*clauses))
+        return query, count_query, joins, count_joins
+
+    def list_options(self):
+        return [load_only(*self.list_columns)] if self.list_columns else []
+
+    def get_list(self, page, sort_column, sort_desc, search, filters, execute=True, page_size=None):
+        count, query = super().get_list(page, sort_column, sort_desc, search, filters, execute=False,
+                                        page_size=page_size)
+        if not execute:  # exports
+            return count, query.options(*self.list_options())
+        g.admin_rows = self.row_estimate(query, bool(search or filters))
+        if sort_column is None and self.keyset_columns:
+            unpaged = query.limit(None).offset(None).order_by(None).options(*self.list_options())
+            g.admin_page = keyset_paginate(unpaged, self.keyset_columns, request.args.get('after'),
+                                           page_size or self.page_size)
+            return None, g.admin_page.items
+        return None, query.options(*self.list_options()).all()  # a clicked sort column still pages by offset
+
+    def row_estimate(self, query, filtered):  # (rows, exact), counting at most count_limit + 1 of them
+        pk = self.model.__mapper__.primary_key[0]
+        bounded = query.limit(None).offset(None).order_by(None).with_entities(pk).limit(self.count_limit + 1).subquery()
+        rows = db.session.query(func.count()).select_from(bounded).scalar()
+        if rows <= self.count_limit:
+            return rows, True
+        sql = TABLE_ESTIMATES.get(db.session.get_bind().dialect.name)
+        if sql and not filtered:
+            estimate = db.session.execute(text(sql), {'table': self.model.__tablename__}).scalar()
+            if estimate and estimate > rows:
+                return int(estimate), False
+        return self.count_limit, False
+
+    def cursor_url(self, cursor):  # this list with the same search and filters, at another page
+        args = request.args.to_dict(flat=False)
+        args['after'] = cursor
+        return url_for('.index_view', **args)
+
+
+class PostView(KeysetModelView):
+    list_template = 'admin/post_list.html'
+    column_list = ('id', 'title', 'author.username', 'date_posted', 'updated_at', 'views')
+    column_labels = {'author.username': 'Author'}
+    column_sortable_list = ('date_posted', 'views')  # indexed. ordering by title would sort the whole table
+    keyset_columns = (Post.date_posted, Post.id)  # ix_post_date_posted_id
+    list_columns = (Post.id, Post.title, Post.user_id, Post.date_posted, Post.updated_at, Post.views)
+    search_columns = (User.username,)  # unique, so indexed
+    search_join = 'author'  # the backref, which only exists once the mappers are configured
+    form_excluded_columns = ('content_html', 'content_html_version', 'updated_at', 'views')  # all derived
+
+    def on_model_change(self, form, model, is_created):  # before the commit, so the html and the index go with it
+        render_content(model)
+        search_index.add(model)
+
+    def on_model_delete(self, model):
+        search_index.remove(model)
+
+    def after_model_change(self, form, model, is_created):
+        page_cache.invalidate('main.home')
+
+    def after_model_delete(self, model):
+        page_cache.invalidate('main.home')
+
+    def list_options(self):
+        if request.args.get('search'):  # reuse the search join for the author instead of joining twice
+            return super().list_options() + [contains_eager(Post.author).load_only(User.username)]
+        return super().list_options() + [joinedload(Post.author).load_only(User.username)]
+
+    @action('delete', 'Delete', 'Are you sure you want to delete the selected posts?')
+    def action_delete(self, ids):  # one DELETE for all of them, not a load and delete per post
+        post_ids = [int(i) for i in ids]
+        search_index.remove_posts(post_ids)
+        count = Post.query.filter(Post.id.in_(post_ids)).delete(synchronize_session=False)
+        db.session.commit()
+        page_cache.invalidate('main.home')
+        flash(f'{count} posts were deleted.', 'success')
+
+    @action('reassign', 'Reassign author', 'Give the selected posts to the user named in the box?')
+    def action_reassign(self, ids):
+        username = request.form.get('reassign_to', '').strip()
+        user_id = db.session.query(User.id).filter_by(username=username).scalar()
+        if user_id is None:
+            flash(f'There is no user named "{username}".', 'error')
+            return
+        count = Post.query.filter(Post.id.in_([int(i) for i in ids])) \
+            .update({Post.user_id: user_id, Post.updated_at: datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+        page_cache.invalidate('main.home')
+        flash(f'{count} posts now belong to {username}.', 'success')
+
+
+class PatternView(KeysetModelView):
+    column_list = ('id', 'position', 'title', 'slug', 'updated_at', 'views')
+    column_sortable_list = ('position', 'views')
+    keyset_columns = (Pattern.id,)
+    list_columns = (Pattern.id, Pattern.position, Pattern.title, Pattern.slug, Pattern.updated_at, Pattern.views)
+    search_columns = (Pattern.title, Pattern.slug)  # both unique
+    form_excluded_columns = ('content_html', 'content_html_version', 'updated_at', 'views',
+                             'sections')  # derived, or edited on the pattern pages
+
+    def on_model_change(self, form, model, is_created):  # runs before the commit, so the stamp moves with the edit
+        render_content(model)
+        search_index.add(model)
+        catalogue.invalidate()
+
+    def on_model_delete(self, model):
+        search_index.remove_pattern(model.id)  # its sections cascade, so their index rows go too
+        catalogue.invalidate()
+
+    def after_model_change(self, form, model, is_created):
+        page_cache.invalidate('patterns.index', pattern_tag(model.slug))
+
+    def after_model_delete(self, model):
+        page_cache.invalidate('patterns.index', pattern_tag(model.slug))
+
+    @action('delete', 'Delete', 'Are you sure you want to delete the selected patterns and their sections?')
+    def action_delete(self, ids):
+        pattern_ids = [int(i) for i in ids]
+        slugs = [slug for slug, in db.session.query(Pattern.slug).filter(Pattern.id.in_(pattern_ids))]
+        search_index.remove_patterns(pattern_ids)
+        count = Pattern.query.filter(Pattern.id.in_(pattern_ids)).delete(synchronize_session=False)  # sections cascade
+        catalogue.invalidate()
+        db.session.commit()
+        page_cache.invalidate('patterns.index', *[pattern_tag(slug) for slug in slugs])
+        flash(f'{count} patterns were deleted.', 'success')
+
+
+admin.add_view(UserView(User, db.session))
+admin.add_view(PostView(Post, db.session))
+admin.add_view(PatternView(Pattern, db.session))
@@ -0,0 +1,124 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import click
+from flask import request, current_app, send_from_directory
+from flask.cli import with_appcontext
+
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt', '.map', '.html')
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))  # preferred first
+
+
+def fingerprinted(name, data):  # css/main.css -> css/main.3f2a9c01d4.css
+    stem, ext = os.path.splitext(name)
+    return f'{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}'
+
+
+def brotli_compress(data):  # None when the optional brotli package isn't installed
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli.compress(data, quality=11)
+
+
+def write_file(path, data):  # write next to the target and rename, so a reader never sees half a file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.tmp{os.getpid()}'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class StaticAssets:  # serves collected static files under content-hashed names, precompressed, cached forever
+    def __init__(self, app=None):
+        self.manifest = {}  # source name -> fingerprinted name inside the dist folder
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ASSETS_DIST', 'dist')  # folder inside static/ the collect step writes to
+        app.config.setdefault('ASSETS_EXCLUDE', ('profile_pics',))  # user uploads are not build artifacts
+        app.config.setdefault('ASSETS_MAX_AGE', 31536000)
+        app.extensions['assets'] = self
+        self.manifest = self.load_manifest(app)
+        app.add_url_rule(f"{app.static_url_path}/{app.config['ASSETS_DIST']}/<path:filename>",
+                         endpoint='assets', view_func=self.send_asset)
+        app.url_defaults(self.fingerprint_url)
+        app.cli.add_command(assets_cli)
+
+    @staticmethod
+    def dist_folder(app):
+        return os.path.join(app.static_folder, app.config['ASSETS_DIST'])
+
+    def load_manifest(self, app):  # no manifest (nothing collected yet) means plain static urls
+        try:
+            with open(os.path.join(self.dist_folder(app), 'manifest.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def fingerprint_url(self, endpoint, values):  # url_for('static', filename='main.css') -> the hashed copy
+        if endpoint == 'static' and values.get('filename') in self.manifest:
+            values['filename'] = f"{current_app.config['ASSETS_DIST']}/{self.manifest[values['filename']]}"
+
+    def send_asset(self, filename):
+        folder = self.dist_folder(current_app)
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        encoding = None
+        for name, suffix in ENCODINGS:
+            if request.accept_encodings[name] and os.path.isfile(os.path.join(folder, filename + suffix)):
+                encoding = name
+                filename += suffix
+                break
+        response = send_from_directory(folder, filename, mimetype=mimetype,
+                                       cache_timeout=current_app.config['ASSETS_MAX_AGE'])
+        if encoding:
+            response.content_encoding = encoding
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True  # the name changes whenever the content does
+        return response
+
+    def collect(self, app):  # copy every static file into dist under its hashed name, returns the manifest
+        source, dist = app.static_folder, self.dist_folder(app)
+        skip = {app.config['ASSETS_DIST'], *app.config['ASSETS_EXCLUDE']}
+        manifest = {}
+        for root, dirs, files in os.walk(source):
+            if root == source:
+                dirs[:] = [d for d in dirs if d not in skip]
+            for file in sorted(files):
+                path = os.path.join(root, file)
+                name = os.path.relpath(path, source).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    data = f.read()
+                manifest[name] = fingerprinted(name, data)
+                target = os.path.join(dist, manifest[name])
+                if os.path.exists(target):  # same content, already built
+                    continue
+                write_file(target, data)
+                if name.endswith(COMPRESSIBLE):
+                    write_file(target + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+                    compressed = brotli_compress(data)
+                    if compressed is not None:
+                        write_file(target + '.br', compressed)
+        write_file(os.path.join(dist, 'manifest.json'), json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+        self.manifest = manifest
+        return manifest
+
+
+@click.group('assets')
+def assets_cli():
+    """Build fingerprinted static files."""
+
+
+@assets_cli.command('collect')
+@with_appcontext
+def collect_command():  # flask assets collect: run on deploy, running processes pick it up on restart
+    app = current_app._get_current_object()
+    manifest = app.extensions['assets'].collect(app)
+    for name, built in sorted(manifest.items()):
+        click.echo(f'  {name} -> {built}')
+    click.echo(f"Collected {len(manifest)} files into {app.config['ASSETS_DIST']}/.")
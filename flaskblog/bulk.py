@@ -0,0 +1,257 @@
+import json
+import time
+from datetime import datetime
+from itertools import islice
+import click
+from flask.cli import with_appcontext
+from flaskblog import db, page_cache
+from flaskblog.models import User, Post, Pattern, Section
+from flaskblog.patterns.catalogue import catalogue
+from flaskblog.patterns.routes import pattern_tag
+from flaskblog.patterns.utils import slugify
+from flaskblog.rendering import rendered_fields
+
+# one json object per line, {"type": "pattern" | "section" | "post", ...}. rows are matched on natural keys,
+# never on ids, so a dump loads into any database: patterns by slug, sections by (pattern slug, title),
+# posts by (author username, date_posted, title). ids are written out for reference only
+KINDS = ('pattern', 'section', 'post')
+REQUIRED = {'pattern': ('title',), 'section': ('pattern', 'title'), 'post': ('author', 'title')}
+SKIP_SAMPLES = 20  # skipped lines reported by number and reason, the rest are only counted
+
+
+def _iso(value):
+    return value.isoformat() if value is not None else None
+
+
+def _datetime(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+def _keyset(query, key, chunk_size):  # rows in primary key order without holding a cursor across chunks
+    last = None
+    while True:
+        chunk = (query.filter(key > last) if last is not None else query).order_by(key).limit(chunk_size).all()
+        if not chunk:
+            return
+        last = chunk[-1].id
+        yield from chunk
+
+
+def export_rows(kinds=KINDS, chunk_size=1000):  # generator of dicts, only chunk_size rows in memory at once
+    if 'pattern' in kinds:
+        query = db.session.query(Pattern.id, Pattern.position, Pattern.title, Pattern.slug, Pattern.content,
+                                 Pattern.updated_at)
+        for row in _keyset(query, Pattern.id, chunk_size):
+            yield dict(type='pattern', id=row.id, slug=row.slug, position=row.position, title=row.title,
+                       content=row.content, updated_at=_iso(row.updated_at))
+    if 'section' in kinds:
+        query = db.session.query(Section.id, Pattern.slug.label('pattern'), Section.title, Section.content,
+                                 Section.updated_at).join(Pattern, Pattern.id == Section.pattern_id)
+        for row in _keyset(query, Section.id, chunk_size):
+            yield dict(type='section', id=row.id, pattern=row.pattern, title=row.title, content=row.content,
+                       updated_at=_iso(row.updated_at))
+    if 'post' in kinds:
+        query = db.session.query(Post.id, User.username.label('author'), Post.title, Post.content,
+                                 Post.date_posted, Post.updated_at).join(User, User.id == Post.user_id)
+        for row in _keyset(query, Post.id, chunk_size):
+            yield dict(type='post', id=row.id, author=row.author, title=row.title, content=row.content,
+                       date_posted=_iso(row.date_posted), updated_at=_iso(row.updated_at))
+
+
+class ImportStats:  # counts only, so memory stays flat however long the dump
+    def __init__(self):
+        self.inserted = dict.fromkeys(KINDS, 0)
+        self.updated = dict.fromkeys(KINDS, 0)
+        self.skipped = 0
+        self.skip_samples = []  # (line number, reason) of the first SKIP_SAMPLES skipped lines
+        self.lines = 0
+
+    def skip(self, line, reason):
+        self.skipped += 1
+        if len(self.skip_samples) < SKIP_SAMPLES:
+            self.skip_samples.append((line, reason))
+
+    def summary(self):
+        parts = [f'{kind}s +{self.inserted[kind]} ~{self.updated[kind]}' for kind in KINDS]
+        return ', '.join(parts) + f', {self.skipped} skipped'
+
+
+def parse_record(text):  # (type, record), raises ValueError for anything an importer couldn't handle
+    record = json.loads(text)
+    if not isinstance(record, dict) or record.get('type') not in KINDS:
+        raise ValueError(f"type must be one of {', '.join(KINDS)}")
+    for key in REQUIRED[record['type']]:
+        if not isinstance(record.get(key), str) or not record[key]:
+            raise ValueError(f"{record['type']} without {key!r}")
+    for key in ('date_posted', 'updated_at'):
+        if record.get(key):
+            datetime.fromisoformat(str(record[key]))  # raises ValueError for a malformed date
+    return record['type'], record
+
+
+def _upsert(model, rows, stats, kind):  # rows carry 'id' when they matched an existing row
+    inserts = [row for row in rows if 'id' not in row]
+    updates = [row for row in rows if 'id' in row]
+    if inserts:
+        db.session.bulk_insert_mappings(model, inserts)
+    if updates:
+        db.session.bulk_update_mappings(model, updates)
+    stats.inserted[kind] += len(inserts)
+    stats.updated[kind] += len(updates)
+
+
+def _import_patterns(records, stats):  # each importer returns the page cache tags of the pages it changed
+    slugs = {r.get('slug') or slugify(r['title']) for _, r in records}
+    existing = dict(db.session.query(Pattern.slug, Pattern.id).filter(Pattern.slug.in_(slugs)))
+    rows = {}
+    for _, r in records:  # last one wins when a slug repeats within the chunk
+        slug = r.get('slug') or slugify(r['title'])
+        row = dict(slug=slug, title=r['title'], content=r.get('content'), position=r.get('position', 0),
+                   **rendered_fields(r.get('content')))
+        if r.get('updated_at'):
+            row['updated_at'] = _datetime(r['updated_at'])
+        if slug in existing:
+            row['id'] = existing[slug]
+        rows[slug] = row
+    _upsert(Pattern, list(rows.values()), stats, 'pattern')
+    return {'patterns.index', *map(pattern_tag, rows)} if rows else set()
+
+
+def _import_sections(records, stats):
+    slugs = {r['pattern'] for _, r in records}
+    pattern_ids = dict(db.session.query(Pattern.slug, Pattern.id).filter(Pattern.slug.in_(slugs)))
+    titles = {r['title'] for _, r in records}
+    existing = {(pattern_id, title): section_id for section_id, pattern_id, title in
+                db.session.query(Section.id, Section.pattern_id, Section.title)
+                .filter(Section.pattern_id.in_(pattern_ids.values()), Section.title.in_(titles))}
+    rows = {}
+    for line, r in records:
+        pattern_id = pattern_ids.get(r['pattern'])
+        if pattern_id is None:
+            stats.skip(line, f"section {r['title']!r}: no pattern {r['pattern']!r}")
+            continue
+        row = dict(pattern_id=pattern_id, title=r['title'], content=r.get('content') or '',
+                   **rendered_fields(r.get('content')))
+        if (pattern_id, r['title']) in existing:
+            row['id'] = existing[(pattern_id, r['title'])]
+        rows[(pattern_id, r['title'])] = row
+    _upsert(Section, list(rows.values()), stats, 'section')
+    touched = {pattern_id for pattern_id, _ in rows}
+    if touched:  # the pattern pages list these sections, so their etags must change
+        Pattern.query.filter(Pattern.id.in_(touched)) \
+            .update({Pattern.updated_at: datetime.utcnow()}, synchronize_session=False)
+    return {pattern_tag(slug) for slug, pattern_id in pattern_ids.items() if pattern_id in touched}
+
+
+def _import_posts(records, stats):
+    authors = dict(db.session.query(User.username, User.id)
+                   .filter(User.username.in_({r['author'] for _, r in records})))
+    titles = {r['title'] for _, r in records}
+    existing = {(user_id, date_posted, title): post_id for post_id, user_id, date_posted, title in
+                db.session.query(Post.id, Post.user_id, Post.date_posted, Post.title)
+                .filter(Post.user_id.in_(authors.values()), Post.title.in_(titles))}
+    rows = {}
+    for line, r in records:
+        user_id = authors.get(r['author'])
+        if user_id is None:
+            stats.skip(line, f"post {r['title']!r}: no user {r['author']!r}")
+            continue
+        date_posted = _datetime(r.get('date_posted')) or datetime.utcnow()
+        row = dict(user_id=user_id, title=r['title'], content=r.get('content') or '', date_posted=date_posted,
+                   **rendered_fields(r.get('content')))
+        if r.get('updated_at'):
+            row['updated_at'] = _datetime(r['updated_at'])
+        key = (user_id, date_posted, r['title'])
+        if key in existing:
+            row['id'] = existing[key]
+        rows[key] = row
+    _upsert(Post, list(rows.values()), stats, 'post')
+    return {'main.home'} if rows else set()
+
+
+IMPORTERS = (('pattern', _import_patterns), ('section', _import_sections), ('post', _import_posts))
+
+
+def import_lines(lines, chunk_size=1000, progress=None):  # one transaction per chunk of lines
+    stats = ImportStats()
+    numbered = enumerate(lines, 1)
+    while True:
+        chunk = list(islice(numbered, chunk_size))
+        if not chunk:
+            break
+        by_kind = {kind: [] for kind in KINDS}
+        for line, text in chunk:
+            if not text.strip():
+                continue
+            try:
+                kind, record = parse_record(text)
+            except ValueError as e:  # json's decode errors included
+                stats.skip(line, f'invalid record: {e}')
+            else:
+                by_kind[kind].append((line, record))
+        pages = set()
+        try:
+            for kind, importer in IMPORTERS:  # patterns first so sections in the same chunk find them
+                if by_kind[kind]:
+                    pages |= importer(by_kind[kind], stats)
+                    db.session.flush()
+            if by_kind['pattern'] or by_kind['section']:
+                catalogue.invalidate()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            raise click.ClickException(f'Import failed in lines {chunk[0][0]}-{chunk[-1][0]}, '
+                                       f'earlier chunks are committed: {e}')
+        page_cache.invalidate(*sorted(pages))  # as each chunk commits, nothing accumulates across the dump
+        stats.lines = chunk[-1][0]
+        if progress:
+            progress(stats)
+    return stats
+
+
+@click.group('data')
+def data_cli():
+    """Bulk export and import of patterns, sections and posts as NDJSON."""
+
+
+@data_cli.command('export')
+@click.argument('output', type=click.File('w'), default='-')
+@click.option('--only', 'kinds', multiple=True, type=click.Choice(KINDS), help='Limit to these types, repeatable.')
+@click.option('--chunk-size', default=1000, show_default=True, help='Rows read per query.')
+@with_appcontext
+def export_command(output, kinds, chunk_size):  # flask data export dump.ndjson (or - for stdout)
+    count = 0
+    for row in export_rows(kinds or KINDS, chunk_size):
+        output.write(json.dumps(row, ensure_ascii=False) + '\n')
+        count += 1
+    if output.name != '<stdout>':
+        click.echo(f'Exported {count} rows.', err=True)
+
+
+@data_cli.command('import')
+@click.argument('source', type=click.File('r'), default='-')
+@click.option('--chunk-size', default=1000, show_default=True, help='Lines per transaction.')
+@click.option('--reindex/--no-reindex', default=True, show_default=True,
+              help='Rebuild the search index once the rows are in.')
+@with_appcontext
+def import_command(source, chunk_size, reindex):  # flask data import dump.ndjson: insert new rows, update matching ones
+    started = time.perf_counter()
+
+    def progress(stats):
+        rate = stats.lines / max(time.perf_counter() - started, 1e-9)
+        click.echo(f'  {stats.lines} lines ({rate:.0f}/s): {stats.summary()}', err=True)
+
+    stats = import_lines(source, chunk_size, progress)
+    for line, reason in stats.skip_samples:
+        click.echo(f'  skipped line {line}: {reason}', err=True)
+    if stats.skipped > len(stats.skip_samples):
+        click.echo(f'  ... and {stats.skipped - len(stats.skip_samples)} more', err=True)
+    click.echo(f'Imported {stats.lines} lines: {stats.summary()}.', err=True)
+    if not any(stats.inserted.values()) and not any(stats.updated.values()):
+        return
+    if reindex:  # chunked like the import, so it stays flat in memory too
+        from flaskblog.search.index import search_index
+        count = search_index.rebuild(progress=lambda n: click.echo(f'  {n} documents indexed', err=True))
+        click.echo(f'Rebuilt the search index, {count} documents.', err=True)
+    else:
+        click.echo('Run `flask search reindex` to make the imported rows searchable.', err=True)
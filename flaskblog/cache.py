@@ -0,0 +1,174 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import request, session, current_app
+from flask_login import current_user
+
+
+class NullCache:  # caching switched off: never stores anything
+    def get(self, key):
+        return None
+
+    def set(self, key, value, timeout=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def incr(self, key):
+        return 0
+
+    def get_counter(self, key):
+        return 0
+
+    def clear(self):
+        pass
+
+
+class LRUCache:  # in-process, thread-safe LRU with a bound on the number of entries and optional expiry
+    def __init__(self, max_entries=1024, default_timeout=None):
+        self.max_entries = max_entries
+        self.default_timeout = default_timeout
+        self._data = OrderedDict()  # key -> (expires_at or None, value), oldest first
+        self._counters = {}  # generation counters live outside the LRU so eviction can't reset them
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        timeout = self.default_timeout if timeout is None else timeout
+        expires_at = time.monotonic() + timeout if timeout else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def get_counter(self, key):
+        return self._counters.get(key, 0)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._counters.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisCache:  # shared across workers. talks to redis or anything speaking its protocol (keydb, fakeredis...)
+    def __init__(self, url=None, client=None, default_timeout=None, prefix='flaskblog:'):
+        if client is None:
+            import redis  # optional dependency, only needed when CACHE_TYPE = 'redis'
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.default_timeout = default_timeout
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return value.decode('utf-8') if value is not None else None
+
+    def set(self, key, value, timeout=None):
+        timeout = self.default_timeout if timeout is None else timeout
+        self.client.set(self.prefix + key, value.encode('utf-8'), ex=timeout or None)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+    def get_counter(self, key):
+        value = self.client.get(self.prefix + key)
+        return int(value) if value is not None else 0
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+def make_backend(config):
+    cache_type = config['CACHE_TYPE']
+    if cache_type == 'lru':
+        return LRUCache(max_entries=config['CACHE_MAX_ENTRIES'], default_timeout=config['CACHE_DEFAULT_TIMEOUT'])
+    if cache_type == 'redis':
+        return RedisCache(url=config['CACHE_REDIS_URL'], default_timeout=config['CACHE_DEFAULT_TIMEOUT'])
+    if cache_type == 'null':
+        return NullCache()
+    raise ValueError(f'unknown CACHE_TYPE {cache_type!r}')
+
+
+def viewer_role():  # pages differ for anonymous users, logged in users and admins, nothing finer than that
+    if not current_user.is_authenticated:
+        return 'anon'
+    return current_user.role or 'user'
+
+
+class PageCache:  # caches rendered pages by tag. bumping a tag's generation invalidates every page under it
+    def __init__(self, app=None):
+        self.backend = NullCache()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CACHE_TYPE', 'lru')
+        app.config.setdefault('CACHE_MAX_ENTRIES', 1024)
+        app.config.setdefault('CACHE_DEFAULT_TIMEOUT', 300)
+        app.config.setdefault('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+        self.backend = make_backend(app.config)
+        app.extensions['page_cache'] = self
+
+    def key_for(self, tag, vary=''):
+        generation = self.backend.get_counter('gen:' + tag)
+        args = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+        return f'page:{tag}:{generation}:{vary}:{viewer_role()}:{args}'
+
+    def invalidate(self, *tags):
+        for tag in tags:
+            self.backend.incr('gen:' + tag)
+
+    def cached(self, tag=None, timeout=None, vary=None):  # tag is a string or a function of the view's kwargs
+        # vary(**kwargs) returns the version of the data the page is rendered from, when that can lag a tag bump
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                # flashed messages are rendered into the page once, so never serve or store those
+                if request.method != 'GET' or '_flashes' in session or current_app.config['CACHE_TYPE'] == 'null':
+                    return view(*args, **kwargs)
+                if tag is None:
+                    page_tag = request.endpoint
+                elif callable(tag):
+                    page_tag = tag(**kwargs)
+                else:
+                    page_tag = tag
+                key = self.key_for(page_tag, vary(**kwargs) if vary is not None else '')
+                body = self.backend.get(key)
+                if body is not None:
+                    return body
+                rv = view(*args, **kwargs)
+                if isinstance(rv, str):  # only plain rendered pages, not redirects or (body, status) tuples
+                    self.backend.set(key, rv, timeout)
+                return rv
+            return wrapper
+        return decorator
@@ -0,0 +1,160 @@
+import threading
+import time
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional, gzip only without it
+    brotli = None
+
+
+class _Gzip:
+    def __init__(self, level):
+        self._z = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # 16+ gives a gzip header
+
+    def compress(self, chunk):  # sync flush so every chunk of a stream reaches the browser straight away
+        return self._z.compress(chunk) + self._z.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._z.flush()
+
+
+class _Brotli:
+    def __init__(self, level):
+        self._c = brotli.Compressor(quality=level)
+
+    def compress(self, chunk):
+        return self._c.process(chunk) + self._c.flush()
+
+    def finish(self):
+        return self._c.finish()
+
+
+class Compressor:  # gzip/brotli for rendered pages, buffered or streamed. static/dist is precompressed already
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self.levels = {'gzip': 6, 'br': 4}
+        self.min_size = 500
+        self.mimetypes = set()
+        self.algorithms = ()
+        self.counters = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_ALGORITHMS', ('br', 'gzip'))  # server preference, first accepted wins
+        app.config.setdefault('COMPRESS_LEVEL', 6)  # gzip, 1-9
+        app.config.setdefault('COMPRESS_BR_LEVEL', 4)  # brotli, 0-11. above ~5 costs far more cpu than it saves
+        app.config.setdefault('COMPRESS_MIN_SIZE', 500)  # bytes, smaller bodies go out as they are
+        app.config.setdefault('COMPRESS_MIMETYPES', ('text/html', 'text/css', 'text/plain', 'text/xml',
+                                                     'application/json', 'application/javascript', 'image/svg+xml'))
+        self.levels = {'gzip': app.config['COMPRESS_LEVEL'], 'br': app.config['COMPRESS_BR_LEVEL']}
+        self.min_size = app.config['COMPRESS_MIN_SIZE']
+        self.mimetypes = set(app.config['COMPRESS_MIMETYPES'])
+        self.algorithms = tuple(a for a in app.config['COMPRESS_ALGORITHMS'] if a != 'br' or brotli is not None)
+        self.counters = {a: dict(responses=0, bytes_in=0, bytes_out=0, cpu_seconds=0.0) for a in self.algorithms}
+        self.counters['skipped'] = dict(responses=0)
+        app.extensions['compressor'] = self
+        app.after_request(self.compress_response)
+
+    def _encoder(self, encoding):
+        return _Gzip(self.levels['gzip']) if encoding == 'gzip' else _Brotli(self.levels['br'])
+
+    def _record(self, encoding, bytes_in, bytes_out, cpu):
+        with self._lock:
+            counter = self.counters[encoding]
+            counter['bytes_in'] += bytes_in
+            counter['bytes_out'] += bytes_out
+            counter['cpu_seconds'] += cpu
+
+    def _skip(self, response):
+        with self._lock:
+            self.counters['skipped']['responses'] += 1
+        return response
+
+    def choose(self):  # best encoding the client accepts, or None
+        for encoding in self.algorithms:
+            if request.accept_encodings[encoding]:
+                return encoding
+        return None
+
+    def compress_response(self, response):
+        if (response.status_code < 200 or response.status_code in (204, 206, 304)
+                or response.direct_passthrough  # send_file responses, static files
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in self.mimetypes):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = self.choose()
+        if encoding is None:
+            return response
+
+        if response.is_streamed:  # peek until we know the body is big enough, the rest stays a stream
+            source = response.response
+            chunks, head, size = iter(source), [], 0
+            for chunk in chunks:
+                head.append(chunk if isinstance(chunk, bytes) else chunk.encode(response.charset))
+                size += len(head[-1])
+                if size >= self.min_size:
+                    break
+            else:
+                response.set_data(b''.join(head))
+                _close(source)
+                return self._skip(response)
+            response.response = self._stream(encoding, head, chunks, response.charset, source)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return self._skip(response)
+            started = time.thread_time()
+            encoder = self._encoder(encoding)
+            body = encoder.compress(data) + encoder.finish()
+            self._record(encoding, len(data), len(body), time.thread_time() - started)
+            if len(body) >= len(data):  # incompressible, not worth the client's time either
+                return self._skip(response)
+            response.set_data(body)
+
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:  # the compressed bytes differ from what the strong etag promised
+            response.set_etag(etag, weak=True)
+        with self._lock:
+            self.counters[encoding]['responses'] += 1
+        return response
+
+    def _stream(self, encoding, head, chunks, charset, source):
+        encoder, bytes_in, bytes_out, cpu = self._encoder(encoding), 0, 0, 0.0
+        try:
+            for chunk in _chain(head, chunks):
+                if not isinstance(chunk, bytes):
+                    chunk = chunk.encode(charset)
+                started = time.thread_time()
+                out = encoder.compress(chunk)
+                cpu += time.thread_time() - started
+                bytes_in, bytes_out = bytes_in + len(chunk), bytes_out + len(out)
+                if out:
+                    yield out
+            started = time.thread_time()
+            out = encoder.finish()
+            cpu += time.thread_time() - started
+            bytes_out += len(out)
+            yield out
+        finally:  # count what we did even if the client went away half way through
+            self._record(encoding, bytes_in, bytes_out, cpu)
+            _close(source)
+
+    def stats(self):  # totals per encoding since startup: bytes saved is bytes_in - bytes_out
+        with self._lock:
+            return {name: dict(counter) for name, counter in self.counters.items()}
+
+
+def _close(iterable):  # werkzeug would have closed the original body, now it's ours to close
+    if hasattr(iterable, 'close'):
+        iterable.close()
+
+
+def _chain(head, rest):
+    yield from head
+    yield from rest
@@ -0,0 +1,50 @@
+import hashlib
+from functools import wraps
+from flask import request, session, current_app, make_response
+from flask_login import current_user
+from werkzeug.http import is_resource_modified
+
+
+def viewer_key():  # pages show edit buttons to their owner, so validators are per user rather than per role
+    if not current_user.is_authenticated:
+        return 'anon'
+    return f'user:{current_user.get_id()}'
+
+
+def make_etag(*parts):
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:20]
+
+
+def conditional(validator, per_viewer=True):  # answer If-None-Match / If-Modified-Since with a 304 before the view runs
+    # validator(**view_kwargs) returns (last_modified, *parts) from a cheap projected query, or None to
+    # let the view decide (usually a 404). every part that changes the rendered page must be in there.
+    # per_viewer=False is for responses that are the same for everybody, like json data
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # a pending flash message would be lost on a 304, so always render those
+            if request.method not in ('GET', 'HEAD') or '_flashes' in session:
+                return view(*args, **kwargs)
+            version = validator(**kwargs)
+            if version is None:
+                return view(*args, **kwargs)
+            last_modified, viewer = version[0], viewer_key() if per_viewer else 'anon'
+            etag = make_etag(request.endpoint, request.full_path, viewer, *version)
+            if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            if per_viewer:
+                response.vary.add('Cookie')  # who is logged in comes from the session cookie
+            if viewer == 'anon':  # shared caches may keep it, but must check back with us before reuse
+                response.cache_control.public = True
+            else:
+                response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
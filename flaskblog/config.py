@@ -4,9 +4,52 @@ import os
 class Config:  # environment variables containing secret info found on my windows machine. will need to re-evaluate this
     SECRET_KEY = os.environ.get('SECRET_KEY')
     SQLALCHEMY_DATABASE_URI = os.environ.get('SQLALCHEMY_DATABASE_URI')
-    MAIL_SERVER = '64.233.184.108'
-    MAIL_PORT = 465
+    DB_REPLICA_URIS = [uri for uri in os.environ.get('DB_REPLICA_URIS', '').split(',') if uri]  # read-only copies
+    DB_READ_YOUR_WRITES_SECONDS = 5  # after writing, a client reads from the primary for this long
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))  # per process and per database, ignored on sqlite
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_RECYCLE = 1800  # seconds, below the server's idle connection timeout
+    DB_POOL_PRE_PING = True
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')  # safe with WAL, FULL for every commit fsynced
+    SQLITE_BUSY_TIMEOUT = 5000  # ms
+    MAIL_SERVER = os.environ.get('MAIL_SERVER', '64.233.184.108')  # point at a local smtp server to test the outbox
+    MAIL_PORT = int(os.environ.get('MAIL_PORT', 465))
     MAIL_USE_TLS = False
-    MAIL_USE_SSL = True
+    MAIL_USE_SSL = os.environ.get('MAIL_USE_SSL', '1') == '1'
     MAIL_USERNAME = os.environ.get('EMAIL_USER')
     MAIL_PASSWORD = os.environ.get('EMAIL_PASS')
+    MAIL_OUTBOX_WORKER = os.environ.get('MAIL_OUTBOX_WORKER', 'thread')  # 'none' when `flask outbox run` delivers
+    MAIL_OUTBOX_BATCH_SIZE = 50
+    MAIL_OUTBOX_MAX_ATTEMPTS = 6  # retries back off 30s, 60s, 120s... then the message is dead-lettered
+    AVATAR_WORKERS = int(os.environ.get('AVATAR_WORKERS', 2))  # processes resizing uploaded profile pictures
+    AVATAR_MAX_AGE = 31536000  # avatar urls are content addressed, so browsers may keep them for a year
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))  # existing hashes are upgraded on next login
+    BCRYPT_MAX_CONCURRENCY = int(os.environ.get('BCRYPT_MAX_CONCURRENCY', os.cpu_count() or 1))
+    BCRYPT_MAX_QUEUE = 32  # logins waiting on the bcrypt pool before we answer 503
+    SQL_QUERY_BUDGET = int(os.environ.get('SQL_QUERY_BUDGET', 0))  # max queries per request, 0 turns it off
+    SQL_QUERY_BUDGET_RAISE = os.environ.get('SQL_QUERY_BUDGET_RAISE') == '1'  # fail the request instead of logging
+    SQL_N_PLUS_ONE_THRESHOLD = 3  # same statement this many times in one request gets flagged as N+1
+    CACHE_TYPE = os.environ.get('CACHE_TYPE', 'lru')  # 'lru' (per process), 'redis' (shared) or 'null'
+    CACHE_MAX_ENTRIES = 1024  # size bound for the in-process LRU
+    CACHE_DEFAULT_TIMEOUT = 300  # seconds. writes invalidate explicitly, this only catches edits made elsewhere
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    USER_CACHE_TTL = 60  # seconds another worker may serve a stale role or username after an edit
+    USER_CACHE_SIZE = 4096  # users kept per process
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'auto')  # 'fts5' on sqlite, 'inverted' everywhere else
+    SEARCH_PER_PAGE = 10
+    VIEW_COUNTER_FLUSH_INTERVAL = int(os.environ.get('VIEW_COUNTER_FLUSH_INTERVAL', 10))  # seconds between batches
+    VIEW_COUNTER_MAX_KEYS = 20000  # posts and patterns buffered per process before new ones are dropped
+    PATTERN_CATALOGUE_CHECK_INTERVAL = 2  # seconds between version_stamp reads, how long other workers lag an edit
+    PATTERN_LAZY_SECTIONS = os.environ.get('PATTERN_LAZY_SECTIONS', '1') == '1'  # section bodies load on expand
+    COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))  # gzip level for pages, tune against compressor.stats()
+    COMPRESS_BR_LEVEL = int(os.environ.get('COMPRESS_BR_LEVEL', 4))  # brotli quality, 0-11
+    COMPRESS_MIN_SIZE = 500  # bytes. smaller pages aren't worth the cpu
+    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # bytes per request body, larger uploads get a 413
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # bearer token for /metrics and the profiler, both refused without it
+    METRICS_PROFILER = os.environ.get('METRICS_PROFILER') == '1'  # POST /metrics/profile?endpoint=... to sample
+    ADMIN_ENABLED = os.environ.get('ADMIN_ENABLED', '1') == '1'  # '0' on workers that never serve /admin
+    PRINCIPAL_ENABLED = os.environ.get('PRINCIPAL_ENABLED') == '1'  # nothing checks permissions through it yet
+    MIGRATE_ENABLED = os.environ.get('MIGRATE_ENABLED') == '1'  # always on under the flask command
+    TEMPLATES_PRECOMPILE = os.environ.get('TEMPLATES_PRECOMPILE') == '1'  # compile every template in create_app
+    TEMPLATES_BYTECODE_CACHE = os.environ.get('TEMPLATES_BYTECODE_CACHE')  # directory for compiled templates
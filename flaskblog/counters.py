@@ -0,0 +1,123 @@
+import atexit
+import logging
+import threading
+from collections import Counter
+from functools import wraps
+from flask import current_app, request
+from sqlalchemy import bindparam
+from flaskblog import db
+from flaskblog.models import Post, Pattern
+
+logger = logging.getLogger(__name__)
+
+TARGETS = {'post': (Post.__table__, 'id'), 'pattern': (Pattern.__table__, 'slug')}  # kind -> (table, key column)
+
+
+def _increment(table, key):  # one statement, run with executemany for every row in the batch
+    return table.update().where(table.c[key] == bindparam('_key')) \
+        .values(views=table.c.views + bindparam('_hits'),
+                updated_at=table.c.updated_at)  # not an edit: keep updated_at, and with it etags and page caches
+
+
+class ViewCounter:  # coalesces view counts in memory and adds them to the database in batches
+    def __init__(self, app=None):
+        self._pending = Counter()  # (kind, key) -> views not yet written
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._worker = None
+        self._app = None
+        self.flushed = 0  # views written so far
+        self.dropped = 0  # views lost because the buffer was full
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('VIEW_COUNTER_ENABLED', True)
+        app.config.setdefault('VIEW_COUNTER_FLUSH_INTERVAL', 10)  # seconds, 0 writes every view straight away
+        app.config.setdefault('VIEW_COUNTER_FLUSH_SIZE', 500)  # distinct rows that trigger an early flush
+        app.config.setdefault('VIEW_COUNTER_MAX_KEYS', 20000)  # memory bound when the database can't keep up
+        app.extensions['view_counter'] = self
+
+    def hit(self, kind, key):
+        app = current_app._get_current_object()
+        config = app.config
+        if not config['VIEW_COUNTER_ENABLED']:
+            return
+        with self._lock:
+            if (kind, key) not in self._pending and len(self._pending) >= config['VIEW_COUNTER_MAX_KEYS']:
+                self.dropped += 1  # new rows are refused, rows already buffered keep counting
+                return
+            self._pending[(kind, key)] += 1
+            size = len(self._pending)
+        if not config['VIEW_COUNTER_FLUSH_INTERVAL']:
+            self.flush(app)
+            return
+        self.start_worker(app)
+        if size >= config['VIEW_COUNTER_FLUSH_SIZE']:
+            self._wake.set()
+
+    def flush(self, app=None):  # write everything buffered, one transaction and one statement per kind
+        app = app or self._app or current_app._get_current_object()
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+        if not pending:
+            return 0
+        batches = {}
+        for (kind, key), hits in pending.items():
+            batches.setdefault(kind, []).append({'_key': key, '_hits': hits})
+        try:
+            with app.app_context():
+                # straight on the primary engine: never a replica, and never the request's own session
+                with db.get_engine(app).begin() as conn:
+                    for kind, params in batches.items():
+                        conn.execute(_increment(*TARGETS[kind]), params)
+        except Exception:
+            logger.exception('view counter flush failed, keeping %s rows for the next one', len(pending))
+            with self._lock:
+                for item, hits in pending.items():
+                    if item in self._pending or len(self._pending) < app.config['VIEW_COUNTER_MAX_KEYS']:
+                        self._pending[item] += hits
+                    else:
+                        self.dropped += hits
+            return 0
+        written = sum(pending.values())
+        with self._lock:
+            self.flushed += written
+        return written
+
+    def run(self, app):  # worker loop: flush every interval, or sooner when the buffer fills up
+        while True:
+            self._wake.wait(app.config['VIEW_COUNTER_FLUSH_INTERVAL'])
+            self._wake.clear()
+            self.flush(app)
+
+    def start_worker(self, app):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._app = app
+                self._worker = threading.Thread(target=self.run, args=(app,), name='view-counter', daemon=True)
+                self._worker.start()
+                atexit.register(self.flush, app)  # daemon threads die with the process, take the buffer with us
+
+    def stats(self):
+        with self._lock:
+            return dict(pending_rows=len(self._pending), pending_views=sum(self._pending.values()),
+                        flushed=self.flushed, dropped=self.dropped)
+
+
+view_counter = ViewCounter()
+
+
+def counted(kind, arg):  # count a view of the row named by url argument `arg`, page cache hits and 304s included
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            response = current_app.make_response(view(*args, **kwargs))
+            if request.method == 'GET' and response.status_code in (200, 304):
+                view_counter.hit(kind, kwargs[arg])
+            return response
+        return wrapper
+    return decorator
+
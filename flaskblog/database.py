@@ -0,0 +1,141 @@
+import random
+import sqlite3
+import time
+from functools import wraps
+import click
+from flask import g, request, current_app, has_request_context
+from flask.cli import with_appcontext
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+
+WRITE_COOKIE = 'dbw'  # set after a request wrote, so the follow-up GET reads its own writes from the primary
+
+
+def replica_keys(app):
+    return [f'replica{i}' for i in range(len(app.config['DB_REPLICA_URIS']))]
+
+
+def route():  # bind key this request reads from, None for the primary. decided once per request
+    if not has_request_context():
+        return None  # cli commands, the outbox worker, migrations
+    if '_db_route' not in g:
+        keys = current_app.extensions['db_routing']
+        if (not keys or request.method not in ('GET', 'HEAD')
+                or request.cookies.get(WRITE_COOKIE)):
+            g._db_route = None
+        else:
+            g._db_route = random.choice(keys)
+    return g._db_route
+
+
+def use_primary():  # make the rest of this request read from the primary
+    if has_request_context():
+        g._db_route = None
+
+
+def primary(view):  # decorator for GET views that must never see replication lag
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        use_primary()
+        return view(*args, **kwargs)
+    return wrapper
+
+
+class RoutingSession(SignallingSession):  # reads in GET requests go to a replica, everything else to the primary
+    def __init__(self, db, **options):
+        self._db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        key = None if self._flushing else route()
+        if key is None:
+            return super().get_bind(mapper, clause)
+        return self._db.get_engine(self.app, bind=key)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _wrote(session, flush_context):  # pin the rest of the request, and the client's next few, to the primary
+    if has_request_context():
+        g._db_route = None
+        g._db_wrote = True
+
+
+def _remember_write(response):
+    if g.get('_db_wrote') and current_app.extensions['db_routing']:
+        response.set_cookie(WRITE_COOKIE, '1', max_age=current_app.config['DB_READ_YOUR_WRITES_SECONDS'],
+                            httponly=True, samesite='Lax')
+    return response
+
+
+def sqlite_pragmas(config):
+    return (('foreign_keys', 'ON'),  # sqlite ignores ON DELETE CASCADE otherwise
+            ('journal_mode', config['SQLITE_JOURNAL_MODE']),  # WAL: readers don't block the writer
+            ('synchronous', config['SQLITE_SYNCHRONOUS']),
+            ('busy_timeout', int(config['SQLITE_BUSY_TIMEOUT'])))  # ms to wait for a lock before "database is locked"
+
+
+class RoutingSQLAlchemy(SQLAlchemy):  # flask_sqlalchemy with replica binds, pool settings and sqlite pragmas
+    def init_app(self, app):
+        app.config.setdefault('DB_REPLICA_URIS', [])
+        app.config.setdefault('DB_READ_YOUR_WRITES_SECONDS', 5)  # longer than the worst replication lag
+        app.config.setdefault('DB_POOL_SIZE', 10)
+        app.config.setdefault('DB_MAX_OVERFLOW', 10)
+        app.config.setdefault('DB_POOL_TIMEOUT', 10)
+        app.config.setdefault('DB_POOL_RECYCLE', 1800)
+        app.config.setdefault('DB_POOL_PRE_PING', True)
+        app.config.setdefault('SQLITE_JOURNAL_MODE', 'WAL')
+        app.config.setdefault('SQLITE_SYNCHRONOUS', 'NORMAL')
+        app.config.setdefault('SQLITE_BUSY_TIMEOUT', 5000)
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        binds.update(zip(replica_keys(app), app.config['DB_REPLICA_URIS']))
+        app.config['SQLALCHEMY_BINDS'] = binds
+        app.extensions['db_routing'] = replica_keys(app)
+        super().init_app(app)
+        app.after_request(_remember_write)
+        app.cli.add_command(sync_replicas_command)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        sa_url, options = super().apply_driver_hacks(app, sa_url, options)
+        config = app.config
+        if sa_url.drivername.startswith('sqlite'):  # NullPool or StaticPool, both take no sizes
+            options['_sqlite_pragmas'] = sqlite_pragmas(config)
+        else:
+            options.setdefault('pool_size', config['DB_POOL_SIZE'])
+            options.setdefault('max_overflow', config['DB_MAX_OVERFLOW'])
+            options.setdefault('pool_timeout', config['DB_POOL_TIMEOUT'])
+        options.setdefault('pool_recycle', config['DB_POOL_RECYCLE'])  # before the server drops idle connections
+        options.setdefault('pool_pre_ping', config['DB_POOL_PRE_PING'])  # replace dead connections transparently
+        return sa_url, options
+
+    def create_engine(self, sa_url, engine_opts):
+        pragmas = engine_opts.pop('_sqlite_pragmas', None)
+        engine = super().create_engine(sa_url, engine_opts)
+        if pragmas:
+            @event.listens_for(engine, 'connect')
+            def set_pragmas(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                for name, value in pragmas:
+                    cursor.execute(f'PRAGMA {name}={value}')
+                cursor.close()
+        return engine
+
+
+@click.command('db-sync-replicas')
+@with_appcontext
+def sync_replicas_command():  # flask db-sync-replicas: copy a sqlite primary onto sqlite replicas, for local testing
+    db = current_app.extensions['sqlalchemy'].db
+    primary_engine = db.get_engine(current_app)
+    if primary_engine.url.drivername != 'sqlite':
+        raise click.ClickException('Only SQLite replicas can be synced here, use real replication elsewhere.')
+    for key in replica_keys(current_app):
+        target = db.get_engine(current_app, bind=key).url.database
+        source = sqlite3.connect(primary_engine.url.database)
+        try:
+            with sqlite3.connect(target) as destination:
+                source.backup(destination)
+        finally:
+            source.close()
+        click.echo(f'Copied {primary_engine.url.database} to {target} ({key}) at {time.strftime("%H:%M:%S")}.')
@@ -1,4 +1,5 @@
 from flask import Blueprint, render_template
+from flaskblog.users.passwords import HasherBusy
 
 errors = Blueprint('errors', __name__)
 
@@ -13,6 +14,11 @@ def error_403(error):
     return render_template('errors/403.html'), 403
 
 
+@errors.app_errorhandler(HasherBusy)
+def error_hasher_busy(error):  # too many logins at once, ask the client to come back shortly
+    return render_template('errors/503.html'), 503, {'Retry-After': '5'}
+
+
 @errors.app_errorhandler(500)
 def error_500(error):
     return render_template('errors/500.html'), 500
@@ -1,18 +1,30 @@
 from flask import render_template, request, Blueprint
-from flaskblog.models import Post
+from flaskblog import db, page_cache
+from flaskblog.models import Post, Pattern, User
+from flaskblog.posts.utils import paginate_feed
 
 main = Blueprint('main', __name__)
 
 
 @main.route("/")
 @main.route("/home")  # Each successive @app.route is a different way to get to the same page.
+@page_cache.cached('main.home')  # rendered pages are cached per cursor and role until a post changes
 def home():
-    page = request.args.get('page', 1, type=int)
-    posts = Post.query.order_by(Post.date_posted.desc())\
-        .paginate(page=page, per_page=5)  # paginate, order by descending and set number of posts per page
+    cursor = request.args.get('cursor')
+    posts = paginate_feed(cursor=cursor, per_page=5)  # keyset paginate on (date_posted, id), newest first
     return render_template('home.html', posts=posts)  # returns the html code from the home.html file
 
 
+@main.route("/popular")
+@page_cache.cached('main.popular', timeout=60)  # counts move all the time, a minute behind is fine
+def popular():  # most viewed posts and patterns, read off the (views, id) indexes
+    posts = db.session.query(Post.id, Post.title, Post.views, User.username).join(Post.author) \
+        .filter(Post.views > 0).order_by(Post.views.desc(), Post.id.desc()).limit(10).all()
+    patterns = db.session.query(Pattern.slug, Pattern.title, Pattern.views) \
+        .filter(Pattern.views > 0).order_by(Pattern.views.desc(), Pattern.id.desc()).limit(10).all()
+    return render_template('popular.html', title='Most Viewed', posts=posts, patterns=patterns)
+
+
 @main.route("/about")
 def about():
     return render_template('about.html', title='About')
@@ -0,0 +1,285 @@
+import hmac
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from flask import request, g, current_app, abort, has_request_context, before_render_template, template_rendered
+from flaskblog.querystats import current_query_stats
+
+# numbers are per process: with several workers, scrape each one or sum them in prometheus
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COMPONENTS = ('sql', 'template', 'bcrypt')  # where a request's time went. mail is timed by the outbox worker
+
+
+class Histogram:  # prometheus style: counts per upper bound, plus a sum and a count
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # the last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {self.sum:.6f}'
+        yield f'{name}_count{{{labels}}} {cumulative}'
+
+
+@contextmanager
+def track(component):  # add the time spent in the block to the current request's component total
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if has_request_context():
+            timings = g.get('_metrics_timings')
+            if timings is not None:
+                timings[component] += time.perf_counter() - started
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:  # per-endpoint latency histograms, in-flight and error counts, served as prometheus text
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self.requests = {}  # endpoint -> Histogram of total request time
+        self.components = {}  # (endpoint, component) -> Histogram
+        self.responses = Counter()  # (endpoint, status) -> count
+        self.errors = Counter()  # endpoint -> unhandled exceptions
+        self.mail_batches = Histogram()  # outbox deliveries, outside of any request
+        self.mail = {}  # (stage, result) -> Histogram of the outbox worker's smtp handshakes and sends
+        self.in_flight = 0
+        self.profiler = None
+        self._serving = {}  # thread id -> endpoint it is serving, for the profiler
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', True)
+        app.config.setdefault('METRICS_PATH', '/metrics')
+        app.config.setdefault('METRICS_TOKEN', None)  # "Authorization: Bearer <token>", without one only debug serves
+        app.config.setdefault('METRICS_PROFILER', False)  # allow the token to run the sampling profiler
+        app.extensions['metrics'] = self
+        if not app.config['METRICS_ENABLED']:
+            return
+        app.before_request(self._start_request)
+        app.after_request(self._record_response)
+        app.teardown_request(self._finish_request)
+        before_render_template.connect(self._template_started, app)
+        template_rendered.connect(self._template_finished, app)
+        path = app.config['METRICS_PATH']
+        app.add_url_rule(path, endpoint='metrics', view_func=self.metrics_view)
+        app.add_url_rule(f'{path}/profile', endpoint='metrics_profile', view_func=self.profile_view,
+                         methods=['GET', 'POST'])
+
+    def _start_request(self):
+        g._metrics_started = time.perf_counter()
+        g._metrics_timings = dict.fromkeys(COMPONENTS, 0.0)
+        with self._lock:
+            self.in_flight += 1
+            self._serving[threading.get_ident()] = request.endpoint
+
+    @staticmethod
+    def _template_started(sender, template, context, **extra):
+        g._metrics_template_started = time.perf_counter()
+
+    @staticmethod
+    def _template_finished(sender, template, context, **extra):
+        started = g.pop('_metrics_template_started', None)
+        timings = g.get('_metrics_timings')
+        if started is not None and timings is not None:
+            timings['template'] += time.perf_counter() - started
+
+    @staticmethod
+    def _record_response(response):
+        g._metrics_status = response.status_code
+        return response
+
+    def _finish_request(self, exc):
+        started = g.pop('_metrics_started', None)
+        if started is None:  # an earlier before_request answered before ours ran
+            return
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or 'unmatched'  # one label for every 404 url, not one each
+        timings = g.pop('_metrics_timings')
+        stats = current_query_stats()
+        if stats is not None:
+            timings['sql'] = stats.duration
+        status = 500 if exc is not None else g.get('_metrics_status', 500)
+        with self._lock:
+            self.in_flight -= 1
+            self._serving.pop(threading.get_ident(), None)
+            if endpoint not in self.requests:
+                self.requests[endpoint] = Histogram()
+                for component in COMPONENTS:
+                    self.components[(endpoint, component)] = Histogram()
+            self.requests[endpoint].observe(elapsed)
+            for component, seconds in timings.items():
+                self.components[(endpoint, component)].observe(seconds)
+            self.responses[(endpoint, status)] += 1
+            if exc is not None:
+                self.errors[endpoint] += 1
+
+    def observe_mail_batch(self, seconds):
+        with self._lock:
+            self.mail_batches.observe(seconds)
+
+    def observe_mail(self, stage, seconds, ok):  # stage is 'connect' or 'send'
+        key = (stage, 'ok' if ok else 'error')
+        with self._lock:
+            if key not in self.mail:
+                self.mail[key] = Histogram()
+            self.mail[key].observe(seconds)
+
+    def _authorized(self):  # a header, never the session cookie, so another site can't post a profile for an admin
+        token = current_app.config['METRICS_TOKEN']
+        if token:
+            return hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+        return current_app.debug  # open on a developer's machine, closed in production until a token is set
+
+    def render(self):  # the prometheus text exposition format
+        out = []
+
+        def metric(name, kind, help_text):
+            out.append(f'# HELP {name} {help_text}')
+            out.append(f'# TYPE {name} {kind}')
+
+        with self._lock:
+            metric('flaskblog_request_duration_seconds', 'histogram', 'Time to serve a request, by endpoint.')
+            for endpoint, histogram in sorted(self.requests.items()):
+                out.extend(histogram.lines('flaskblog_request_duration_seconds', f'endpoint="{_escape(endpoint)}"'))
+            metric('flaskblog_request_component_seconds', 'histogram',
+                   'Time a request spent in sql, template rendering and bcrypt.')
+            for (endpoint, component), histogram in sorted(self.components.items()):
+                out.extend(histogram.lines('flaskblog_request_component_seconds',
+                                           f'endpoint="{_escape(endpoint)}",component="{component}"'))
+            metric('flaskblog_responses_total', 'counter', 'Responses sent, by endpoint and status code.')
+            for (endpoint, status), count in sorted(self.responses.items()):
+                out.append(f'flaskblog_responses_total{{endpoint="{_escape(endpoint)}",status="{status}"}} {count}')
+            metric('flaskblog_request_exceptions_total', 'counter', 'Unhandled exceptions, by endpoint.')
+            for endpoint, count in sorted(self.errors.items()):
+                out.append(f'flaskblog_request_exceptions_total{{endpoint="{_escape(endpoint)}"}} {count}')
+            metric('flaskblog_requests_in_flight', 'gauge', 'Requests being served right now.')
+            out.append(f'flaskblog_requests_in_flight {self.in_flight}')
+            metric('flaskblog_mail_batch_seconds', 'histogram', 'Outbox delivery time per smtp batch.')
+            out.extend(self.mail_batches.lines('flaskblog_mail_batch_seconds', 'worker="outbox"'))
+            metric('flaskblog_mail_smtp_seconds', 'histogram', 'Outbox smtp handshakes and sends, by result.')
+            for (stage, result), histogram in sorted(self.mail.items()):
+                out.extend(histogram.lines('flaskblog_mail_smtp_seconds', f'stage="{stage}",result="{result}"'))
+
+        hasher = current_app.extensions.get('password_hasher')
+        if hasher is not None:
+            bcrypt_stats = hasher.stats()
+            metric('flaskblog_bcrypt_pool', 'gauge', 'Hashes running and queued on the bcrypt pool.')
+            out.append(f'flaskblog_bcrypt_pool{{state="running"}} {bcrypt_stats["in_flight"]}')
+            out.append(f'flaskblog_bcrypt_pool{{state="queued"}} {bcrypt_stats["queued"]}')
+            metric('flaskblog_bcrypt_rejected_total', 'counter', 'Hashes refused because the queue was full.')
+            out.append(f'flaskblog_bcrypt_rejected_total {bcrypt_stats["rejected"]}')
+        compressor = current_app.extensions.get('compressor')
+        if compressor is not None:
+            metric('flaskblog_compression_bytes_total', 'counter', 'Response bytes before and after compression.')
+            metric('flaskblog_compression_cpu_seconds_total', 'counter', 'Thread cpu time spent compressing.')
+            for encoding, counter in compressor.stats().items():
+                if encoding == 'skipped':
+                    continue
+                out.append(f'flaskblog_compression_bytes_total{{encoding="{encoding}",stage="in"}} {counter["bytes_in"]}')
+                out.append(f'flaskblog_compression_bytes_total{{encoding="{encoding}",stage="out"}} {counter["bytes_out"]}')
+                out.append(f'flaskblog_compression_cpu_seconds_total{{encoding="{encoding}"}} {counter["cpu_seconds"]:.6f}')
+        view_counter = current_app.extensions.get('view_counter')
+        if view_counter is not None:
+            views = view_counter.stats()
+            metric('flaskblog_view_counter_pending', 'gauge', 'Views buffered in this process, not yet written.')
+            out.append(f'flaskblog_view_counter_pending {views["pending_views"]}')
+            metric('flaskblog_view_counter_views_total', 'counter', 'Views written to the database, and dropped.')
+            out.append(f'flaskblog_view_counter_views_total{{result="flushed"}} {views["flushed"]}')
+            out.append(f'flaskblog_view_counter_views_total{{result="dropped"}} {views["dropped"]}')
+        catalogue = current_app.extensions.get('pattern_catalogue')
+        if catalogue is not None:
+            snapshot = catalogue.stats()
+            metric('flaskblog_pattern_catalogue_version', 'gauge', 'version_stamp of the pattern snapshot served.')
+            out.append(f'flaskblog_pattern_catalogue_version {snapshot["version"] or 0}')
+            metric('flaskblog_pattern_catalogue_reloads_total', 'counter', 'Pattern snapshots loaded by this process.')
+            out.append(f'flaskblog_pattern_catalogue_reloads_total {snapshot["reloads"]}')
+        return '\n'.join(out) + '\n'
+
+    def metrics_view(self):
+        if not self._authorized():
+            abort(403)
+        return current_app.response_class(self.render(), mimetype='text/plain; version=0.0.4')
+
+    def profile_view(self):  # POST ?endpoint=main.home&seconds=30 starts one, GET returns the folded stacks
+        if not current_app.config['METRICS_PROFILER']:
+            abort(404)
+        if not self._authorized():
+            abort(403)
+        if request.method == 'POST':
+            endpoint = request.args.get('endpoint')
+            if endpoint not in current_app.view_functions:
+                abort(400)
+            seconds = min(request.args.get('seconds', 30, type=float), 300)
+            interval = max(request.args.get('interval', 0.005, type=float), 0.001)
+            with self._lock:
+                if self.profiler is not None and self.profiler.running:
+                    return 'A profile is already running.\n', 409
+                self.profiler = SamplingProfiler(self, endpoint, seconds, interval)
+            self.profiler.start()
+            return f'Profiling {endpoint} for {seconds:.0f}s.\n', 202
+        if self.profiler is None:
+            return 'No profile has been taken.\n', 404
+        return current_app.response_class(self.profiler.folded(), mimetype='text/plain')
+
+
+class SamplingProfiler:  # samples the stacks of threads serving one endpoint, output in flamegraph folded format
+    def __init__(self, metrics, endpoint, seconds, interval):
+        self.metrics = metrics
+        self.endpoint = endpoint
+        self.seconds = seconds
+        self.interval = interval
+        self.samples = Counter()
+        self.running = False
+        self._thread = None
+
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name='metrics-profiler', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        deadline = time.perf_counter() + self.seconds
+        try:
+            while time.perf_counter() < deadline:
+                with self.metrics._lock:
+                    threads = [tid for tid, endpoint in self.metrics._serving.items() if endpoint == self.endpoint]
+                if threads:
+                    frames = sys._current_frames()
+                    for tid in threads:
+                        frame = frames.get(tid)
+                        if frame is not None:
+                            self.samples[self._stack(frame)] += 1
+                time.sleep(self.interval)
+        finally:
+            self.running = False
+
+    @staticmethod
+    def _stack(frame):  # outermost call first, the way flamegraph.pl wants it
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f'{frame.f_globals.get("__name__", "?")}:{code.co_name}:{frame.f_lineno}')
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def folded(self):
+        status = 'running' if self.running else 'finished'
+        header = f'# {self.endpoint}, {status}, {sum(self.samples.values())} samples\n'
+        return header + ''.join(f'{stack} {count}\n' for stack, count in self.samples.most_common())
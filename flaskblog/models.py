@@ -1,14 +1,41 @@
 from datetime import datetime
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from flask import current_app
-from flaskblog import db, login_manager, admin
+from flaskblog import db, login_manager
+from flaskblog.cache import LRUCache
 from flask_login import UserMixin
-from flask_admin.contrib.sqla import ModelView
+
+user_cache = LRUCache(max_entries=4096)  # user id -> CachedUser, so most requests don't query the user table
 
 
 @login_manager.user_loader
-def load_user(user_id):
-    return User.query.get(int(user_id))
+def load_user(user_id):  # runs on every authenticated request, so serve it from the per-process cache
+    user = user_cache.get(user_id)
+    if user is None:
+        row = User.query.get(int(user_id))
+        if row is None:
+            return None
+        user = CachedUser(row)
+        user_cache.set(user_id, user, current_app.config.get('USER_CACHE_TTL', 60))
+    return user
+
+
+def invalidate_user(user_id):  # call after changing a user so every request sees the new row
+    user_cache.delete(str(user_id))
+
+
+class CachedUser(UserMixin):  # detached read-only copy of the columns current_user needs. load User to change them
+    __slots__ = ('id', 'username', 'email', 'image_file', 'role')
+
+    def __init__(self, user):
+        self.id = user.id
+        self.username = user.username
+        self.email = user.email
+        self.image_file = user.image_file
+        self.role = user.role
+
+    def __repr__(self):
+        return f"CachedUser('{self.username}', '{self.email}', '{self.image_file}')"
 
 
 class User(db.Model, UserMixin):
@@ -41,18 +68,32 @@ class Post(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     date_posted = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    content = db.Column(db.Text, nullable=False)
+    content = db.Column(db.Text, nullable=False)  # markdown, as written
+    content_html = db.Column(db.Text)  # rendered and sanitised on write, see flaskblog.rendering
+    content_html_version = db.Column(db.Integer)  # RENDERER_VERSION that produced content_html
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)  # for etags
+    views = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # written in batches by counters.py
+    __table_args__ = (db.Index('ix_post_date_posted_id', 'date_posted', 'id'),  # the home feed, newest first
+                      db.Index('ix_post_user_id_date_posted', 'user_id', 'date_posted'),  # one author's feed
+                      db.Index('ix_post_views_id', 'views', 'id'))  # most viewed
 
     def __repr__(self):
         return f"Post('{self.title}', '{self.date_posted}')"
 
 
 class Pattern(db.Model):
-    id = db.Column(db.Integer, unique=True, nullable=False)
-    title = db.Column(db.String(100), primary_key=True, unique=True, nullable=False)
+    id = db.Column(db.Integer, primary_key=True)
+    position = db.Column(db.Integer, nullable=False, default=0, index=True)  # sort order in the index
+    title = db.Column(db.String(100), unique=True, nullable=False)
+    slug = db.Column(db.String(100), unique=True, index=True, nullable=False)  # used in urls
     content = db.Column(db.Text)
-    sections = db.relationship('Section', backref='parent_pattern', lazy=True)
+    content_html = db.Column(db.Text)
+    content_html_version = db.Column(db.Integer)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)  # bumped by section edits too
+    views = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    sections = db.relationship('Section', backref='parent_pattern', lazy=True, passive_deletes=True)
+    __table_args__ = (db.Index('ix_pattern_views_id', 'views', 'id'),)
 
     def __repr__(self):
         return f"Pattern('{self.id}', '{self.title}')"
@@ -62,14 +103,60 @@ class Section(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     content = db.Column(db.Text, nullable=False)
-    pattern_title = db.Column(db.Integer, db.ForeignKey('pattern.title'), nullable=False)
+    content_html = db.Column(db.Text)
+    content_html_version = db.Column(db.Integer)
+    pattern_id = db.Column(db.Integer, db.ForeignKey('pattern.id', ondelete='CASCADE'), nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    __table_args__ = (db.Index('ix_section_pattern_id_id', 'pattern_id', 'id'),)  # a pattern's sections, in order
 
     def __repr__(self):
         return f"Section('{self.id}', '{self.title}')"
 
 
-admin.add_view(ModelView(User, db.session))
-admin.add_view(ModelView(Post, db.session))
-admin.add_view(ModelView(Pattern, db.session))
+class VersionStamp(db.Model):  # bumped on every change to some shared data, polled by processes that keep a copy
+    name = db.Column(db.String(50), primary_key=True)  # 'patterns': the pattern catalogue snapshot
+    version = db.Column(db.Integer, nullable=False, default=0)
+
 
+class SearchDocument(db.Model):  # one row per indexed post, pattern or section
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # 'post', 'pattern' or 'section'
+    ref = db.Column(db.String(100), nullable=False)  # primary key of the indexed row
+    parent = db.Column(db.String(100))  # pattern a section belongs to, used to build its url
+    title = db.Column(db.String(100), nullable=False)
+    content = db.Column(db.Text)  # only kept by the inverted index backend, fts5 stores its own copy
+    length = db.Column(db.Integer, nullable=False, default=0)  # number of tokens, for bm25 length normalisation
+    __table_args__ = (db.UniqueConstraint('kind', 'ref'), db.Index('ix_search_document_kind_parent', 'kind', 'parent'))
+
+    def __repr__(self):
+        return f"SearchDocument('{self.kind}', '{self.ref}')"
+
+
+class SearchTerm(db.Model):  # postings of the pure-python inverted index: term -> documents containing it
+    term = db.Column(db.String(64), primary_key=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('search_document.id'), primary_key=True, index=True)
+    frequency = db.Column(db.Integer, nullable=False)
 
+    def __repr__(self):
+        return f"SearchTerm('{self.term}', '{self.document_id}')"
+
+
+class OutboxMessage(db.Model):  # an email waiting for (or done with) delivery by the outbox worker
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(200), nullable=False)
+    sender = db.Column(db.String(120), nullable=False)
+    recipients = db.Column(db.Text, nullable=False)  # comma separated
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    status = db.Column(db.String(10), nullable=False, default='pending')  # pending, sending, sent or dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claimed_by = db.Column(db.String(32))  # worker currently sending it
+    claimed_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    __table_args__ = (db.Index('ix_outbox_message_status_next_attempt_at', 'status', 'next_attempt_at'),)
+
+    def __repr__(self):
+        return f"OutboxMessage('{self.id}', '{self.subject}', '{self.status}')"
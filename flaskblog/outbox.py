@@ -0,0 +1,186 @@
+import logging
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from flask_mail import Message
+from sqlalchemy import and_, or_
+from flaskblog import db, mail
+from flaskblog.models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+
+def backoff(config, attempts):  # seconds to wait before retry number `attempts`, doubling each time
+    return min(config['MAIL_OUTBOX_RETRY_BASE'] * 2 ** (attempts - 1), config['MAIL_OUTBOX_RETRY_MAX'])
+
+
+class Outbox:  # emails are written to a table by the request and delivered later by a background worker
+    def __init__(self, app=None):
+        self._worker = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MAIL_OUTBOX_WORKER', 'thread')  # 'thread' to deliver in-process, 'none' for the cli
+        app.config.setdefault('MAIL_OUTBOX_BATCH_SIZE', 50)  # messages sent over one smtp connection
+        app.config.setdefault('MAIL_OUTBOX_POLL_INTERVAL', 30)  # seconds between checks when nobody wakes us
+        app.config.setdefault('MAIL_OUTBOX_MAX_ATTEMPTS', 6)  # then the message is dead-lettered
+        app.config.setdefault('MAIL_OUTBOX_RETRY_BASE', 30)
+        app.config.setdefault('MAIL_OUTBOX_RETRY_MAX', 3600)
+        app.config.setdefault('MAIL_OUTBOX_CLAIM_TIMEOUT', 600)  # a crashed worker's claims expire after this
+        app.extensions['outbox'] = self
+        app.cli.add_command(outbox_cli)
+        if app.config['MAIL_OUTBOX_WORKER'] == 'thread':
+            app.before_first_request(lambda: self.start_worker(current_app._get_current_object()))
+
+    def enqueue(self, msg):  # store a flask_mail Message and return straight away
+        db.session.add(OutboxMessage(subject=msg.subject, sender=msg.sender,
+                                     recipients=','.join(msg.recipients), body=msg.body, html=msg.html))
+        db.session.commit()
+        if current_app.config['MAIL_OUTBOX_WORKER'] == 'thread':
+            self.start_worker(current_app._get_current_object())
+        self._wake.set()
+
+    def claim(self, limit, worker_id):  # mark up to `limit` due messages as ours so no other worker sends them
+        config = current_app.config
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=config['MAIL_OUTBOX_CLAIM_TIMEOUT'])
+        due = or_(and_(OutboxMessage.status == 'pending', OutboxMessage.next_attempt_at <= now),
+                  and_(OutboxMessage.status == 'sending', OutboxMessage.claimed_at < stale))
+        ids = [i for i, in db.session.query(OutboxMessage.id).filter(due).order_by(OutboxMessage.id).limit(limit)]
+        if not ids:
+            return []
+        OutboxMessage.query.filter(OutboxMessage.id.in_(ids), due) \
+            .update(dict(status='sending', claimed_by=worker_id, claimed_at=now), synchronize_session=False)
+        db.session.commit()
+        return OutboxMessage.query.filter_by(status='sending', claimed_by=worker_id) \
+            .order_by(OutboxMessage.id).all()
+
+    def deliver_batch(self, worker_id=None):  # send one batch over a single smtp connection, returns how many went
+        config = current_app.config
+        worker_id = worker_id or secrets.token_hex(8)
+        batch = self.claim(config['MAIL_OUTBOX_BATCH_SIZE'], worker_id)
+        if not batch:
+            return 0
+        sent, started, connected = 0, time.perf_counter(), None
+        try:
+            with mail.connect() as conn:  # one handshake for the whole batch
+                connected = time.perf_counter()
+                self._observe('connect', connected - started, True)
+                for row in batch:
+                    sending = time.perf_counter()
+                    try:
+                        conn.send(Message(row.subject, sender=row.sender, recipients=row.recipients.split(','),
+                                          body=row.body, html=row.html))
+                    except Exception as e:  # this message failed, the connection may still be fine
+                        self._observe('send', time.perf_counter() - sending, False)
+                        self._failed(row, e)
+                    else:
+                        self._observe('send', time.perf_counter() - sending, True)
+                        row.status = 'sent'
+                        row.sent_at = datetime.utcnow()
+                        row.claimed_by = None
+                        sent += 1
+                    db.session.commit()
+        except Exception as e:  # could not connect (or the connection dropped): retry everything not yet sent
+            if connected is None:
+                self._observe('connect', time.perf_counter() - started, False)
+            for row in batch:
+                if row.status == 'sending':
+                    self._failed(row, e)
+            db.session.commit()
+        metrics = current_app.extensions.get('metrics')
+        if metrics is not None:
+            metrics.observe_mail_batch(time.perf_counter() - started)
+        return sent
+
+    @staticmethod
+    def _observe(stage, seconds, ok):  # smtp latency and failures for /metrics, there's no request to add them to
+        metrics = current_app.extensions.get('metrics')
+        if metrics is not None:
+            metrics.observe_mail(stage, seconds, ok)
+
+    @staticmethod
+    def _failed(row, error):
+        config = current_app.config
+        row.attempts += 1
+        row.last_error = f'{type(error).__name__}: {error}'
+        row.claimed_by = None
+        if row.attempts >= config['MAIL_OUTBOX_MAX_ATTEMPTS']:
+            row.status = 'dead'
+            logger.error('outbox message %s dead after %s attempts: %s', row.id, row.attempts, row.last_error)
+        else:
+            row.status = 'pending'
+            row.next_attempt_at = datetime.utcnow() + timedelta(seconds=backoff(config, row.attempts))
+            logger.warning('outbox message %s failed (attempt %s): %s', row.id, row.attempts, row.last_error)
+
+    def run(self, app, stop=None):  # worker loop: drain whatever is due, then sleep until woken or polled
+        stop = stop or self._stop
+        worker_id = secrets.token_hex(8)
+        while not stop.is_set():
+            self._wake.clear()
+            try:
+                with app.app_context():
+                    while self.deliver_batch(worker_id) and not stop.is_set():
+                        pass
+            except Exception:
+                logger.exception('outbox worker pass failed')
+            self._wake.wait(app.config['MAIL_OUTBOX_POLL_INTERVAL'])
+
+    def start_worker(self, app):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self.run, args=(app,), name='outbox-worker', daemon=True)
+                self._worker.start()
+
+    def stop_worker(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._worker is not None:
+            self._worker.join(timeout)
+
+
+outbox = Outbox()
+
+
+@click.group('outbox')
+def outbox_cli():
+    """Deliver queued emails."""
+
+
+@outbox_cli.command('run')
+@with_appcontext
+def run_command():  # flask outbox run: a dedicated delivery process, use with MAIL_OUTBOX_WORKER = 'none'
+    click.echo('Delivering outbox messages, Ctrl+C to stop.')
+    try:
+        outbox.run(current_app._get_current_object())
+    except KeyboardInterrupt:
+        pass
+
+
+@outbox_cli.command('flush')
+@with_appcontext
+def flush_command():  # flask outbox flush: send everything that is due right now and exit
+    total = 0
+    while True:
+        sent = outbox.deliver_batch()
+        if not sent:
+            break
+        total += sent
+    click.echo(f'Sent {total} messages.')
+
+
+@outbox_cli.command('retry-dead')
+@with_appcontext
+def retry_dead_command():  # flask outbox retry-dead: give dead-lettered messages another round of attempts
+    count = OutboxMessage.query.filter_by(status='dead') \
+        .update(dict(status='pending', attempts=0, next_attempt_at=datetime.utcnow()), synchronize_session=False)
+    db.session.commit()
+    click.echo(f'Requeued {count} messages.')
@@ -0,0 +1,104 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from sqlalchemy import tuple_
+
+
+class KeysetPage:  # one page of a keyset (cursor) paginated query. no OFFSET, no COUNT(*)
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor  # opaque token for the following (older) page
+        self.prev_cursor = prev_cursor  # opaque token for the preceding (newer) page
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and 'dt' in value:
+        return datetime.fromisoformat(value['dt'])
+    return value
+
+
+def encode_cursor(direction, values):  # turn a sort key into a url-safe token the client can't easily tamper with
+    raw = json.dumps([direction, [_encode_value(v) for v in values]], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):  # returns (direction, values) or None if the token is garbage
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        direction, values = json.loads(raw.decode('utf-8'))
+        if direction not in ('next', 'prev') or not isinstance(values, list):
+            return None
+        return direction, [_decode_value(v) for v in values]
+    except (ValueError, TypeError, binascii.Error):
+        return None
+
+
+def _decode_for(cursor, columns):
+    decoded = decode_cursor(cursor)
+    if decoded is not None and len(decoded[1]) != len(columns):
+        return None
+    return decoded
+
+
+def _window(query, columns, decoded, per_page):
+    key = tuple_(*columns)
+    if decoded is None or decoded[0] == 'next':
+        if decoded:
+            query = query.filter(key < tuple_(*decoded[1]))
+        query = query.order_by(*[c.desc() for c in columns])
+    else:  # walk backwards towards newer rows, then flip the page back into display order
+        query = query.filter(key > tuple_(*decoded[1])).order_by(*[c.asc() for c in columns])
+    return query.limit(per_page + 1)
+
+
+def keyset_query(query, columns, cursor=None, per_page=5):  # the query keyset_paginate runs for a cursor, unexecuted
+    return _window(query, columns, _decode_for(cursor, columns), per_page)
+
+
+def keyset_paginate(query, columns, cursor=None, per_page=5):  # newest first on columns, e.g. (date_posted, id)
+    # every page is one range scan of per_page + 1 rows, so deep pages cost the same as the first one
+    base_query = query
+    decoded = _decode_for(cursor, columns)
+    direction = decoded[0] if decoded else 'next'
+
+    rows = _window(query, columns, decoded, per_page).all()
+    has_more = len(rows) > per_page
+    if direction == 'prev' and not has_more:  # we walked back to the top, so just serve a full first page
+        return keyset_paginate(base_query, columns, per_page=per_page)
+    rows = rows[:per_page]
+    if direction == 'prev':
+        rows.reverse()
+
+    def key_of(row):
+        return [getattr(row, c.key) for c in columns]
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if direction == 'next':
+            if has_more:
+                next_cursor = encode_cursor('next', key_of(rows[-1]))
+            if decoded:
+                prev_cursor = encode_cursor('prev', key_of(rows[0]))
+        else:
+            next_cursor = encode_cursor('next', key_of(rows[-1]))
+            if has_more:
+                prev_cursor = encode_cursor('prev', key_of(rows[0]))
+    return KeysetPage(rows, per_page, next_cursor=next_cursor, prev_cursor=prev_cursor)
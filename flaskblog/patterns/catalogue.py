@@ -0,0 +1,145 @@
+import threading
+import time
+from itertools import count, groupby
+from types import MappingProxyType
+from sqlalchemy import event
+from flaskblog import db
+from flaskblog.database import RoutingSession
+from flaskblog.models import Pattern, Section, VersionStamp
+
+STAMP = 'patterns'  # VersionStamp row bumped by every change to a pattern or a section
+
+
+class _Frozen:  # __slots__ record that refuses assignment once built, so any thread may hold it without a lock
+    __slots__ = ()
+
+    def __init__(self, **fields):
+        for name, value in fields.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is read-only')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'{type(self).__name__} is read-only')
+
+
+class SectionEntry(_Frozen):  # content is only kept for rows `flask content rerender` hasn't rendered yet
+    __slots__ = ('id', 'pattern_id', 'title', 'content', 'content_html', 'updated_at')
+
+    def __repr__(self):
+        return f"SectionEntry('{self.id}', '{self.title}')"
+
+
+class PatternEntry(_Frozen):
+    __slots__ = ('id', 'position', 'title', 'slug', 'content', 'content_html', 'updated_at', 'sections')
+
+    def __repr__(self):
+        return f"PatternEntry('{self.id}', '{self.title}')"
+
+
+class CatalogueSnapshot(_Frozen):  # every pattern and section as of one version of the stamp
+    __slots__ = ('version', 'patterns', 'by_slug', 'by_title', 'sections', 'loaded_at')
+
+    def __repr__(self):
+        return f"CatalogueSnapshot('{self.version}', {len(self.patterns)} patterns, {len(self.sections)} sections)"
+
+
+def _entry(cls, row, **extra):
+    fields = dict(row._asdict(), **extra)
+    if fields['content_html'] is not None:
+        fields['content'] = None  # the html is all the pages need
+    return cls(**fields)
+
+
+def read_version():
+    return db.session.query(VersionStamp.version).filter_by(name=STAMP).scalar() or 0
+
+
+def load_snapshot(version):  # two queries, rows come back as tuples so nothing lands in the session
+    sections = db.session.query(Section.id, Section.pattern_id, Section.title, Section.content, Section.content_html,
+                                Section.updated_at).order_by(Section.pattern_id, Section.id)
+    by_pattern = {pattern_id: tuple(_entry(SectionEntry, row) for row in rows)
+                  for pattern_id, rows in groupby(sections, key=lambda row: row.pattern_id)}
+    patterns = tuple(_entry(PatternEntry, row, sections=by_pattern.get(row.id, ()))
+                     for row in db.session.query(Pattern.id, Pattern.position, Pattern.title, Pattern.slug,
+                                                 Pattern.content, Pattern.content_html, Pattern.updated_at)
+                     .order_by(Pattern.position, Pattern.id))  # the index page order
+    return CatalogueSnapshot(version=version, patterns=patterns,
+                             by_slug=MappingProxyType({p.slug: p for p in patterns}),
+                             by_title=MappingProxyType({p.title: p for p in patterns}),
+                             sections=MappingProxyType({s.id: s for p in patterns for s in p.sections}),
+                             loaded_at=time.time())
+
+
+class PatternCatalogue:  # the current snapshot, replaced whole whenever the stamp moves. readers never lock
+    def __init__(self, app=None):
+        self._snapshot = None
+        self._commits = count(1)
+        self._generation = 0  # moved on by every commit in this process that changed the catalogue
+        self._checked = (-1, 0.0)  # (generation, time.monotonic() deadline) of the last stamp read
+        self._lock = threading.Lock()  # one thread checks and reloads, the others keep serving the old snapshot
+        self._interval = 2
+        self.reloads = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PATTERN_CATALOGUE_CHECK_INTERVAL', 2)  # seconds, how stale another worker's edit may be
+        self._interval = app.config['PATTERN_CATALOGUE_CHECK_INTERVAL']
+        self._snapshot = None
+        app.extensions['pattern_catalogue'] = self
+
+    def current(self):  # no query at all between checks, one tiny one per check, two more when it changed
+        snapshot = self._snapshot
+        if snapshot is not None and self._fresh():
+            return snapshot
+        if not self._lock.acquire(blocking=snapshot is None):
+            return snapshot  # somebody else is already checking
+        try:
+            snapshot = self._snapshot
+            if snapshot is None or not self._fresh():
+                generation = self._generation  # a commit landing during the read moves it, forcing another check
+                version = read_version()  # before the rows, so a snapshot is never older than its stamp
+                if snapshot is None or version != snapshot.version:
+                    snapshot = self._snapshot = load_snapshot(version)  # one assignment, readers see old or new
+                    self.reloads += 1
+                self._checked = (generation, time.monotonic() + self._interval)
+            return snapshot
+        finally:
+            self._lock.release()
+
+    def _fresh(self):
+        generation, deadline = self._checked
+        return generation == self._generation and time.monotonic() < deadline
+
+    def committed(self):  # this process changed the catalogue, so don't wait out the interval to show it
+        self._generation = next(self._commits)
+
+    def invalidate(self):  # call in the transaction that changes patterns or sections, before it commits
+        stamp = VersionStamp.__table__
+        bumped = db.session.execute(stamp.update().where(stamp.c.name == STAMP)
+                                    .values(version=stamp.c.version + 1)).rowcount
+        if not bumped:  # a database made by create_all() rather than the migration
+            db.session.execute(stamp.insert().values(name=STAMP, version=1))
+        db.session.info['pattern_catalogue_changed'] = True
+
+    def stats(self):
+        snapshot = self._snapshot
+        return dict(version=snapshot.version if snapshot else None, reloads=self.reloads,
+                    patterns=len(snapshot.patterns) if snapshot else 0,
+                    sections=len(snapshot.sections) if snapshot else 0)
+
+
+catalogue = PatternCatalogue()
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _recheck(session):
+    if session.info.pop('pattern_catalogue_changed', False):
+        catalogue.committed()
+
+
+@event.listens_for(RoutingSession, 'after_soft_rollback')
+def _forget(session, previous_transaction):
+    session.info.pop('pattern_catalogue_changed', None)
@@ -1,14 +1,24 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, SubmitField, TextAreaField, IntegerField
-from wtforms.validators import DataRequired
+from wtforms.validators import DataRequired, InputRequired, Length, ValidationError
+from flaskblog.models import Pattern
 
 
 class PatternForm(FlaskForm):
-    id = IntegerField('ID (used to sort in Index)', validators=[DataRequired()])
-    title = StringField('Title (primary key and URL)', validators=[DataRequired()])
+    position = IntegerField('Position (used to sort in Index)', validators=[InputRequired()])
+    title = StringField('Title', validators=[DataRequired(), Length(max=100)])
     content = TextAreaField('Pattern Summary')
     submit = SubmitField('Create/Update Pattern')
 
+    def __init__(self, *args, pattern_id=None, **kwargs):  # pattern_id: the pattern being edited, it may keep its title
+        super().__init__(*args, **kwargs)
+        self.pattern_id = pattern_id
+
+    def validate_title(self, title):  # the column is unique, say so rather than failing the insert
+        taken = Pattern.query.with_entities(Pattern.id).filter_by(title=title.data).first()  # the primary, the snapshot may be seconds old
+        if taken is not None and taken.id != self.pattern_id:
+            raise ValidationError('That title is taken. Please choose a different one.')
+
 
 class SectionForm(FlaskForm):
     title = StringField('Section Title', validators=[DataRequired()])
@@ -1,19 +1,36 @@
-from flask import (render_template, url_for, flash,
-                   redirect, request, abort, Blueprint)
+from flask import (render_template, url_for, flash, jsonify,
+                   redirect, request, abort, Blueprint, current_app)
 from flask_login import current_user, login_required
-from flaskblog import db
+from flaskblog import db, page_cache
 from flaskblog.models import Pattern, Section
 from flaskblog.patterns.forms import PatternForm, SectionForm
+from flaskblog.conditional import conditional
+from flaskblog.counters import counted
+from flaskblog.patterns.catalogue import catalogue
+from flaskblog.patterns.utils import (unique_slug, pattern_slug_owner, touch_pattern, paginate_list,
+                                      pattern_version, section_version)
+from flaskblog.rendering import render_content, content_html
+from flaskblog.search.index import search_index
 
 patterns = Blueprint('patterns', __name__)
 
+SECTION_BATCH_LIMIT = 50  # most section ids one section_bodies request may ask for
+
+
+def pattern_tag(slug, **kwargs):  # cache tag covering every page of one pattern
+    return f'patterns.pattern:{slug}'
+
+
+def catalogue_version(**kwargs):  # in the page cache key: a worker still on an older snapshot can't store
+    return catalogue.current().version  # its pages where workers on the new one will find them
+
 
 @patterns.route("/patterns/index")
 @patterns.route("/patterns")
-def index():
+@page_cache.cached('patterns.index', vary=catalogue_version)
+def index():  # pages of the catalogue snapshot, no queries
     page = request.args.get('page', 1, type=int)
-    patterns_list = Pattern.query.order_by(Pattern.id.asc()) \
-        .paginate(page=page, per_page=10)
+    patterns_list = paginate_list(catalogue.current().patterns, page, per_page=10)
     return render_template('patterns_index.html', patterns_list=patterns_list)
 
 
@@ -22,48 +39,76 @@ def index():
 def new_pattern():  # let the user make patterns when logged in
     form = PatternForm()
     if form.validate_on_submit():
-        pattern = Pattern(id=form.id.data, title=form.title.data, content=form.content.data)
+        pattern = Pattern(position=form.position.data, title=form.title.data, content=form.content.data,
+                          slug=unique_slug(form.title.data, pattern_slug_owner))
+        render_content(pattern)
         db.session.add(pattern)
+        search_index.add(pattern)
+        catalogue.invalidate()
         db.session.commit()
+        page_cache.invalidate('patterns.index')
         flash('Your pattern has been created!', 'success')
         return redirect(url_for('patterns.index'))
     return render_template('create_pattern.html', title='New Pattern', form=form, legend='New Pattern')
 
 
-@patterns.route("/patterns/<string:title>/new", methods=['GET', 'POST'])
+@patterns.route("/patterns/<string:slug>/new", methods=['GET', 'POST'])
 @login_required
-def new_section(title):  # let the user make patterns when logged in
+def new_section(slug):  # let the user make patterns when logged in
     if current_user.role != 'admin':  # only admins can update
         abort(403)
+    pattern = Pattern.query.filter_by(slug=slug).first_or_404()
     form = SectionForm()
     if form.validate_on_submit():
-        section = Section(title=form.title.data, content=form.content.data, pattern_title=title)
+        section = Section(title=form.title.data, content=form.content.data, pattern_id=pattern.id)
+        render_content(section)
         db.session.add(section)
+        search_index.add(section)
+        touch_pattern(pattern.id)
+        catalogue.invalidate()
         db.session.commit()
+        page_cache.invalidate(pattern_tag(slug))
         flash('Your pattern section has been created!', 'success')
-        return redirect(url_for('patterns.pattern', title=title))
+        return redirect(url_for('patterns.pattern', slug=slug))
     return render_template('create_post.html', title='New Section', form=form, legend='New Section')
 
 
-@patterns.route("/patterns/<string:title>/<int:section_id>")
-def section(section_id):  # make an individual page for each section, distinguished by section_id
-    section = Section.query.get_or_404(section_id)
+@patterns.route("/patterns/<string:slug>/<int:section_id>")
+@conditional(section_version)
+def section(slug, section_id):  # make an individual page for each section, distinguished by section_id
+    section = catalogue.current().sections.get(section_id) or abort(404)
     return render_template('pattern_section.html', title=section.title, section=section)
 
 
-@patterns.route("/patterns/<string:title>")
-def pattern(title):
+@patterns.route("/patterns/<string:slug>")
+@counted('pattern', 'slug')  # outermost, so 304s and page cache hits count too
+@conditional(pattern_version)  # a 304 skips the page cache lookup as well
+@page_cache.cached(pattern_tag, vary=catalogue_version)
+def pattern(slug):
     page = request.args.get('page', 1, type=int)
-    pattern = Pattern.query.filter_by(title=title).first_or_404()
-    sections = Section.query.filter_by(parent_pattern=pattern) \
-        .order_by(Section.id.asc()) \
-        .paginate(page=page, per_page=10)
-    return render_template('pattern.html', sections=sections, pattern=pattern, title=title)
-
-
-@patterns.route("/patterns/<string:title>/<int:section_id>/update", methods=['GET', 'POST'])
+    pattern = catalogue.current().by_slug.get(slug) or abort(404)
+    lazy = current_app.config['PATTERN_LAZY_SECTIONS']  # titles only, section_bodies sends the rest on expand
+    sections = paginate_list(pattern.sections, page, per_page=10)  # already in id order
+    return render_template('pattern.html', sections=sections, pattern=pattern, title=pattern.title, lazy=lazy)
+
+
+@patterns.route("/patterns/<string:slug>/sections.json")
+@conditional(pattern_version, per_viewer=False)  # section edits bump the pattern, so its version covers these
+def section_bodies(slug):  # ?ids=3,4,5 -> the html of those sections, one request for everything opened at once
+    try:
+        ids = {int(i) for i in request.args.get('ids', '').split(',') if i}
+    except ValueError:
+        abort(400)
+    if not ids or len(ids) > SECTION_BATCH_LIMIT:
+        abort(400)
+    pattern = catalogue.current().by_slug.get(slug) or abort(404)
+    return jsonify(sections=[dict(id=section.id, title=section.title, html=content_html(section))
+                             for section in pattern.sections if section.id in ids])
+
+
+@patterns.route("/patterns/<string:slug>/<int:section_id>/update", methods=['GET', 'POST'])
 @login_required
-def update_section(title, section_id):  # let admins update pattern sections
+def update_section(slug, section_id):  # let admins update pattern sections
     if current_user.role != 'admin':  # only admins can update
         abort(403)
     section = Section.query.get_or_404(section_id)
@@ -71,59 +116,74 @@ def update_section(title, section_id):  # let admins update pattern sections
     if form.validate_on_submit():  # update the pattern section in the database
         section.title = form.title.data
         section.content = form.content.data
+        render_content(section)
+        search_index.add(section)
+        touch_pattern(section.pattern_id)
+        catalogue.invalidate()
         db.session.commit()
+        page_cache.invalidate(pattern_tag(slug))
         flash('Your pattern section has been updated!', 'success')
-        return redirect(url_for('patterns.pattern', title=title, section_id=section.id))
+        return redirect(url_for('patterns.pattern', slug=slug))
     elif request.method == 'GET':  # auto populate forms with the existing pattern section info
         form.title.data = section.title
         form.content.data = section.content
     return render_template('create_post.html', title='Update Pattern Section', form=form, legend='Update Section')
 
 
-@patterns.route("/patterns/<string:title>/update", methods=['GET', 'POST'])
+@patterns.route("/patterns/<string:slug>/update", methods=['GET', 'POST'])
 @login_required
-def update_pattern(title):  # let admins update pattern sections
-    pattern = Pattern.query.get_or_404(title)
+def update_pattern(slug):  # let admins update pattern sections
+    pattern = Pattern.query.filter_by(slug=slug).first_or_404()
     if current_user.role != 'admin':  # only admins can update
         abort(403)
-    form = PatternForm()
+    form = PatternForm(pattern_id=pattern.id)
     if form.validate_on_submit():  # update the pattern section in the database
-        pattern.id = form.id.data
+        pattern.position = form.position.data
+        if form.title.data != pattern.title:  # the id stays put, only the url follows the new title
+            pattern.slug = unique_slug(form.title.data, pattern_slug_owner, current_id=pattern.id)
         pattern.title = form.title.data
         pattern.content = form.content.data
+        render_content(pattern)
+        search_index.add(pattern)
+        catalogue.invalidate()
         db.session.commit()
+        page_cache.invalidate('patterns.index', pattern_tag(slug), pattern_tag(pattern.slug))
         flash('Your pattern has been updated!', 'success')
-        return redirect(url_for('patterns.index', pattern_title=pattern.title))
+        return redirect(url_for('patterns.index'))
     elif request.method == 'GET':  # auto populate forms with the existing pattern section info
-        form.id.data = pattern.id
+        form.position.data = pattern.position
         form.title.data = pattern.title
         form.content.data = pattern.content
     return render_template('create_pattern.html', title='Update Pattern', form=form, legend='Update Pattern')
 
 
-@patterns.route("/patterns/<string:title>/<int:section_id>/delete", methods=['POST'])
+@patterns.route("/patterns/<string:slug>/<int:section_id>/delete", methods=['POST'])
 @login_required
-def delete_section(title, section_id):  # let users delete their posts
+def delete_section(slug, section_id):  # let users delete their posts
     section = Section.query.get_or_404(section_id)
     if current_user.role != 'admin':  # only the post owner can delete it
         abort(403)
+    search_index.remove(section)
+    touch_pattern(section.pattern_id)
     db.session.delete(section)
+    catalogue.invalidate()
     db.session.commit()
+    page_cache.invalidate(pattern_tag(slug))
     flash('Your pattern section has been deleted.', 'success')
-    return redirect(url_for('patterns.pattern', title=title))
+    return redirect(url_for('patterns.pattern', slug=slug))
 
 
-@patterns.route("/patterns/<string:title>/delete", methods=['POST'])
+@patterns.route("/patterns/<string:slug>/delete", methods=['POST'])
 @login_required
-def delete_pattern(title):  # let users delete their posts
-    pattern = Pattern.query.get_or_404(title)
-    sections = Section.query.filter_by(parent_pattern=pattern) \
-        .order_by(Section.id.asc())
+def delete_pattern(slug):  # let users delete their posts
     if current_user.role != 'admin':  # only the post owner can delete it
         abort(403)
-    for section in sections:
-        db.session.delete(section)
-    db.session.delete(pattern)
+    pattern_id = Pattern.query.with_entities(Pattern.id).filter_by(slug=slug).first_or_404()[0]
+    search_index.remove_pattern(pattern_id)
+    Pattern.query.filter_by(id=pattern_id).delete(synchronize_session=False)  # sections go with ON DELETE CASCADE
+    catalogue.invalidate()
     db.session.commit()
+    page_cache.invalidate('patterns.index', pattern_tag(slug))
     flash('Your pattern has been deleted.', 'success')
     return redirect(url_for('patterns.index'))
+
@@ -0,0 +1,49 @@
+import re
+import unicodedata
+from datetime import datetime
+from flask import abort
+from flask_sqlalchemy import Pagination
+from flaskblog.models import Pattern
+from flaskblog.patterns.catalogue import catalogue
+
+
+def slugify(title):  # "Morning Routine!" -> "morning-routine"
+    value = unicodedata.normalize('NFKD', title or '').encode('ascii', 'ignore').decode('ascii')
+    value = re.sub(r'[^a-z0-9]+', '-', value.lower()).strip('-')
+    return value[:90] or 'pattern'
+
+
+def unique_slug(title, taken, current_id=None):  # taken(slug) returns the id of the pattern using it, or None
+    base = slugify(title)
+    slug, n = base, 2
+    while True:
+        owner = taken(slug)
+        if owner is None or owner == current_id:
+            return slug
+        slug, n = f'{base}-{n}', n + 1
+
+
+def pattern_slug_owner(slug):
+    row = Pattern.query.with_entities(Pattern.id).filter_by(slug=slug).first()
+    return row[0] if row else None
+
+
+def touch_pattern(pattern_id):  # the pattern page lists its sections, so any section change is a new version of it
+    Pattern.query.filter_by(id=pattern_id).update({Pattern.updated_at: datetime.utcnow()}, synchronize_session=False)
+
+
+def paginate_list(items, page, per_page):  # Query.paginate() over a sequence already in memory, 404 past the end
+    if page < 1 or (page > 1 and (page - 1) * per_page >= len(items)):
+        abort(404)
+    start = (page - 1) * per_page
+    return Pagination(None, page, per_page, len(items), list(items[start:start + per_page]))
+
+
+def pattern_version(slug, **kwargs):
+    pattern = catalogue.current().by_slug.get(slug)
+    return (pattern.updated_at,) if pattern is not None else None
+
+
+def section_version(slug, section_id):
+    section = catalogue.current().sections.get(section_id)
+    return (section.updated_at,) if section is not None else None
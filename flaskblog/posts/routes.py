@@ -1,11 +1,17 @@
+import click
 from flask import (render_template, url_for, flash,
                    redirect, request, abort, Blueprint)
 from flask_login import current_user, login_required
-from flaskblog import db
+from flaskblog import db, page_cache
 from flaskblog.models import Post
 from flaskblog.posts.forms import PostForm
+from flaskblog.conditional import conditional
+from flaskblog.counters import counted
+from flaskblog.posts.utils import check_feed_plans, post_version
+from flaskblog.rendering import render_content
+from flaskblog.search.index import search_index
 
-posts = Blueprint('posts', __name__)
+posts = Blueprint('posts', __name__, cli_group=None)  # its commands sit at the top level of `flask`
 
 
 @posts.route("/post/new", methods=['GET', 'POST'])
@@ -13,17 +19,22 @@ posts = Blueprint('posts', __name__)
 def new_post():  # let the user make posts when logged in
     form = PostForm()
     if form.validate_on_submit():
-        post = Post(title=form.title.data, content=form.content.data, author=current_user)
+        post = Post(title=form.title.data, content=form.content.data, user_id=current_user.id)
+        render_content(post)  # once here, instead of on every view of the post
         db.session.add(post)
+        search_index.add(post)
         db.session.commit()
+        page_cache.invalidate('main.home')
         flash('Your post has been created!', 'success')
         return redirect(url_for('main.home'))
     return render_template('create_post.html', title='New Post', form=form, legend='New Post')
 
 
 @posts.route("/post/<int:post_id>")
+@counted('post', 'post_id')  # outermost, so 304s count too
+@conditional(post_version)
 def post(post_id):  # make an individual page for each post, distinguished by post_id
-    post = Post.query.get_or_404(post_id)
+    post = Post.query.options(db.joinedload(Post.author)).get_or_404(post_id)
     return render_template('post.html', title=post.title, post=post)
 
 
@@ -31,13 +42,16 @@ def post(post_id):  # make an individual page for each post, distinguished by po
 @login_required
 def update_post(post_id):  # let users update their post
     post = Post.query.get_or_404(post_id)
-    if post.author != current_user:  # only the post owner can update it
+    if post.user_id != current_user.id:  # only the post owner can update it
         abort(403)
     form = PostForm()
     if form.validate_on_submit():  # update the post in the database
         post.title = form.title.data
         post.content = form.content.data
+        render_content(post)
+        search_index.add(post)
         db.session.commit()
+        page_cache.invalidate('main.home')
         flash('Your post has been updated!', 'success')
         return redirect(url_for('posts.post', post_id=post.id))
     elif request.method == 'GET':  # auto populate forms with the existing post info
@@ -50,9 +64,25 @@ def update_post(post_id):  # let users update their post
 @login_required
 def delete_post(post_id):  # let users delete their posts
     post = Post.query.get_or_404(post_id)
-    if post.author != current_user:  # only the post owner can delete it
+    if post.user_id != current_user.id:  # only the post owner can delete it
         abort(403)
+    search_index.remove(post)
     db.session.delete(post)
     db.session.commit()
+    page_cache.invalidate('main.home')
     flash('Your post has been deleted.', 'success')
     return redirect(url_for('main.home'))
+
+
+@posts.cli.command('db-explain')
+def db_explain():  # flask db-explain: fail unless the post feeds are served straight from their indexes
+    if db.engine.dialect.name != 'sqlite':
+        raise click.ClickException('db-explain reads SQLite query plans, point SQLALCHEMY_DATABASE_URI at SQLite.')
+    failed = False
+    for feed, page, plan, problems in check_feed_plans():
+        click.echo(f"{feed} ({page} page): {'FAIL ' + ', '.join(problems) if problems else 'ok'}")
+        for line in plan:
+            click.echo(f'    {line}')
+        failed = failed or bool(problems)
+    if failed:
+        raise click.ClickException('Feed queries are not using their indexes, run `flask db upgrade`.')
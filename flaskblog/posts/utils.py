@@ -0,0 +1,53 @@
+from datetime import datetime
+from flaskblog import db
+from flaskblog.models import Post, User
+from flaskblog.pagination import keyset_paginate, keyset_query, encode_cursor
+
+FEED_KEY = (Post.date_posted, Post.id)  # sort key for every post feed, newest first
+FEED_INDEXES = {'home': 'ix_post_date_posted_id', 'user_posts': 'ix_post_user_id_date_posted'}
+
+
+def feed_query(author=None):  # base query behind the home feed and the per-user post lists
+    query = Post.query.options(db.joinedload(Post.author))  # templates show the author of every post
+    if author is not None:
+        query = query.filter(Post.user_id == author.id)
+    return query
+
+
+def paginate_feed(cursor=None, author=None, per_page=5):
+    return keyset_paginate(feed_query(author), FEED_KEY, cursor=cursor, per_page=per_page)
+
+
+def post_version(post_id):  # the post page also shows the author's name and avatar
+    return db.session.query(Post.updated_at, User.username, User.image_file) \
+        .join(Post.author).filter(Post.id == post_id).first()
+
+
+class _Author:  # feed_query only needs an id, the plan is the same whoever it is
+    id = 1
+
+
+def explain_query_plan(query):  # sqlite's EXPLAIN QUERY PLAN detail lines for an orm query
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    params = [compiled.params[name] for name in compiled.positiontup]
+    conn = db.engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('EXPLAIN QUERY PLAN ' + str(compiled), params)
+        return [row[-1] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+
+def check_feed_plans():  # yields (feed, page, plan, problems) for the first and a deep page of every feed
+    deep = encode_cursor('next', [datetime(2000, 1, 1), 1])
+    for feed, index in FEED_INDEXES.items():
+        author = _Author() if feed == 'user_posts' else None
+        for page, cursor in (('first', None), ('deep', deep)):
+            plan = explain_query_plan(keyset_query(feed_query(author), FEED_KEY, cursor=cursor))
+            problems = []
+            if not any(index in line for line in plan):
+                problems.append(f'does not use {index}')
+            if any('TEMP B-TREE' in line for line in plan):
+                problems.append('sorts in a temporary b-tree')
+            yield feed, page, plan, problems
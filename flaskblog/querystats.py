@@ -0,0 +1,113 @@
+import logging
+import re
+import time
+from collections import Counter
+from flask import g, has_request_context, request, current_app
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+_IN_LIST = re.compile(r'\((\s*\?\s*,)+\s*\?\s*\)')  # "(?, ?, ?)" -> "(?)" so IN lists of any length share a shape
+_WHITESPACE = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def statement_shape(statement):  # statements only differing in bound values (or IN list length) share a shape
+    return _IN_LIST.sub('(?)', _WHITESPACE.sub(' ', statement).strip())
+
+
+class RequestQueryStats:  # what one request did against the database
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        self.shapes[statement_shape(statement)] += 1
+
+    def repeated(self, threshold):  # same-shape statements run at least threshold times, most frequent first
+        return [(shape, n) for shape, n in self.shapes.most_common() if n >= threshold]
+
+
+def current_query_stats():  # stats for the request being served, or None outside of a request
+    if not has_request_context():
+        return None
+    return g.get('_query_stats')
+
+
+def query_budget(limit):  # decorator: give a single view its own budget instead of SQL_QUERY_BUDGET
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+class QueryStats:  # counts and times the SQL each request runs, flags N+1 patterns and enforces a budget
+    def __init__(self, app=None):
+        self._listening = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SQL_QUERY_BUDGET', 0)  # 0 means no budget
+        app.config.setdefault('SQL_QUERY_BUDGET_RAISE', False)  # raise instead of log, so tests fail loudly
+        app.config.setdefault('SQL_N_PLUS_ONE_THRESHOLD', 3)  # same-shape statements before we call it N+1
+        app.config.setdefault('SQL_QUERY_STATS_HEADERS', False)  # add X-Query-Count / X-Query-Time to responses
+
+        if not self._listening:  # listen on every engine so replica binds get counted too
+            event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+            self._listening = True
+        app.before_request(self._start_request)
+        app.after_request(self._check_request)
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            conn.info.setdefault('_query_started', []).append(time.perf_counter())
+
+    @staticmethod
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not has_request_context():
+            return
+        started = conn.info.get('_query_started')
+        duration = time.perf_counter() - started.pop() if started else 0.0
+        stats = g.get('_query_stats')
+        if stats is not None:
+            stats.record(statement, duration)
+
+    @staticmethod
+    def _start_request():
+        g._query_stats = RequestQueryStats()
+
+    @staticmethod
+    def _check_request(response):
+        stats = g.get('_query_stats')
+        if stats is None:
+            return response
+        config = current_app.config
+        view = current_app.view_functions.get(request.endpoint)
+        budget = getattr(view, 'query_budget', None)
+        if budget is None:
+            budget = config['SQL_QUERY_BUDGET']
+
+        problems = []
+        for shape, n in stats.repeated(config['SQL_N_PLUS_ONE_THRESHOLD']):
+            problems.append(f'possible N+1: {n}x {shape}')
+        if budget and stats.count > budget:
+            problems.append(f'{stats.count} queries, budget is {budget}')
+        for problem in problems:
+            logger.warning('%s %s: %s', request.method, request.endpoint, problem)
+        if problems and config['SQL_QUERY_BUDGET_RAISE']:
+            raise QueryBudgetExceeded(f'{request.method} {request.path}: ' + '; '.join(problems))
+
+        if config['SQL_QUERY_STATS_HEADERS']:
+            response.headers['X-Query-Count'] = str(stats.count)
+            response.headers['X-Query-Time'] = f'{stats.duration * 1000:.2f}ms'
+        return response
@@ -0,0 +1,126 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
+import bleach
+import click
+import markdown
+from bleach.linkifier import LinkifyFilter
+from flask.cli import with_appcontext
+from markupsafe import Markup, escape
+from flaskblog import db, page_cache
+from flaskblog.models import Post, Pattern, Section
+from flaskblog.patterns.catalogue import catalogue
+
+# bump when the markdown extensions, the allowed tags or anything else that changes the html changes,
+# then run `flask content rerender`. rows rendered by an older version are picked up by it
+RENDERER_VERSION = 1
+EXTENSIONS = ('fenced_code', 'sane_lists', 'nl2br')  # nl2br: a newline in the textarea stays a line break
+ALLOWED_TAGS = ('p', 'br', 'hr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'strong', 'em', 'b', 'i', 'code', 'pre',
+                'blockquote', 'ul', 'ol', 'li', 'a', 'abbr')
+ALLOWED_ATTRIBUTES = {'a': ['href', 'title', 'rel'], 'abbr': ['title']}
+ALLOWED_PROTOCOLS = ('http', 'https', 'mailto')
+MODELS = {'post': Post, 'pattern': Pattern, 'section': Section}
+
+
+def _nofollow(attrs, new=False):
+    attrs[(None, 'rel')] = 'nofollow noopener'
+    return attrs
+
+
+def render_markdown(text):  # markdown in, sanitised html out. runs on writes and in the rerender pool, never per view
+    html = markdown.markdown(text or '', extensions=list(EXTENSIONS))
+    cleaner = bleach.Cleaner(tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES, protocols=ALLOWED_PROTOCOLS, strip=True,
+                             filters=[partial(LinkifyFilter, callbacks=[_nofollow], skip_tags=['pre'])])
+    return cleaner.clean(html)  # one pass: a separate linkify() double-escapes code blocks. cleaners aren't thread safe
+
+
+def render_content(obj):  # call whenever obj.content is set, before committing
+    obj.content_html = render_markdown(obj.content)
+    obj.content_html_version = RENDERER_VERSION
+
+
+def rendered_fields(content):  # the same, for bulk insert and update mappings
+    return dict(content_html=render_markdown(content), content_html_version=RENDERER_VERSION)
+
+
+def content_html(obj):  # template filter: the stored html, or escaped text for rows `flask content rerender` missed
+    if obj.content_html is not None:
+        return Markup(obj.content_html)
+    return Markup('<p>{}</p>').format(escape(obj.content or ''))
+
+
+def _render_rows(rows):  # runs in the pool: [(id, content)] -> [(id, html)]
+    return [(row_id, render_markdown(content)) for row_id, content in rows]
+
+
+def rerender(model, everything=False, chunk_size=500, workers=None, progress=None):
+    # re-render rows written by an older renderer (or all of them), one transaction per chunk.
+    # returns how many rows got different html. those get a new updated_at so etags and page caches move on
+    key = model.id
+    query = db.session.query(model.id, model.content, model.content_html, model.updated_at)
+    if not everything:
+        query = query.filter(db.or_(model.content_html_version.is_(None),
+                                    model.content_html_version < RENDERER_VERSION))
+    workers = workers or os.cpu_count() or 1
+    changed, done, last = 0, 0, None
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:  # walks by primary key, no cursor is held open across the commits
+            chunk = (query.filter(key > last) if last is not None else query).order_by(key).limit(chunk_size).all()
+            if not chunk:
+                break
+            last = chunk[-1].id
+            old = {row.id: row for row in chunk}
+            step = max(len(chunk) // (4 * workers), 1)  # a few batches per process, to even out long rows
+            batches = [[(row.id, row.content) for row in chunk[i:i + step]] for i in range(0, len(chunk), step)]
+            now = datetime.utcnow()
+            mappings, touched = [], set()
+            for rendered in pool.map(_render_rows, batches):
+                for row_id, html in rendered:
+                    changed_html = html != old[row_id].content_html
+                    if changed_html:
+                        touched.add(row_id)
+                    # unchanged rows keep their updated_at: leaving the key out would fire its onupdate
+                    mappings.append(dict(id=row_id, content_html=html, content_html_version=RENDERER_VERSION,
+                                         updated_at=now if changed_html else old[row_id].updated_at))
+            db.session.bulk_update_mappings(model, mappings)
+            if model is Section and touched:  # pattern pages show their sections, so their etags must change
+                parents = db.session.query(Section.pattern_id).filter(Section.id.in_(touched)).distinct()
+                Pattern.query.filter(Pattern.id.in_(parents.subquery())) \
+                    .update({Pattern.updated_at: now}, synchronize_session=False)
+            changed += len(touched)
+            if touched and model is not Post:
+                catalogue.invalidate()
+            db.session.commit()
+            done += len(chunk)
+            if progress:
+                progress(done)
+    return changed
+
+
+@click.group('content')
+def content_cli():
+    """Markdown rendering of posts, patterns and sections."""
+
+
+@content_cli.command('rerender')
+@click.option('--only', 'kinds', multiple=True, type=click.Choice(sorted(MODELS)), help='Limit to these types.')
+@click.option('--all', 'everything', is_flag=True, help='Re-render every row, not just outdated ones.')
+@click.option('--chunk-size', default=500, show_default=True, help='Rows per transaction.')
+@click.option('--workers', type=int, default=None, help='Render processes, default one per cpu.')
+@with_appcontext
+def rerender_command(kinds, everything, chunk_size, workers):  # flask content rerender, after bumping RENDERER_VERSION
+    started = time.perf_counter()
+    total = 0
+    for kind in kinds or ('pattern', 'section', 'post'):
+        click.echo(f'Rendering {kind}s with renderer version {RENDERER_VERSION}...')
+        changed = rerender(MODELS[kind], everything, chunk_size, workers,
+                           progress=lambda n: click.echo(f'  {n} rows'))
+        click.echo(f'  {changed} {kind}s have new html.')
+        total += changed
+    if total:
+        from flaskblog.patterns.routes import pattern_tag
+        slugs = [slug for slug, in db.session.query(Pattern.slug)]
+        page_cache.invalidate('main.home', 'patterns.index', *[pattern_tag(slug) for slug in slugs])
+    click.echo(f'Done in {time.perf_counter() - started:.1f}s.')
@@ -0,0 +1,330 @@
+import math
+import re
+from collections import Counter
+from flask import current_app
+from markupsafe import Markup, escape
+from sqlalchemy import text
+from flaskblog import db
+from flaskblog.models import Post, Pattern, Section, SearchDocument, SearchTerm
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+_OPEN, _CLOSE = '\x02', '\x03'  # highlight sentinels, swapped for <mark> after escaping
+TITLE_WEIGHT = 3  # a title hit counts as much as this many body hits
+MAX_TERM = 64  # search_term.term length, longer tokens are indexed and searched by their prefix
+
+
+def tokenize(value):
+    return [token.lower() for token in _TOKEN.findall(value or '')][:10000]
+
+
+def document_for(obj):  # what gets indexed for a post, pattern or section
+    if isinstance(obj, Post):
+        return dict(kind='post', ref=str(obj.id), parent=None, title=obj.title, content=obj.content)
+    if isinstance(obj, Pattern):
+        return dict(kind='pattern', ref=str(obj.id), parent=None, title=obj.title, content=obj.content or '')
+    if isinstance(obj, Section):
+        return dict(kind='section', ref=str(obj.id), parent=str(obj.pattern_id), title=obj.title, content=obj.content)
+    raise TypeError(f'cannot index {obj!r}')
+
+
+def iter_document_chunks(chunk_size=500):  # everything that should be searchable, walked by primary key
+    for model, key in ((Post, Post.id), (Pattern, Pattern.id), (Section, Section.id)):
+        last = None
+        while True:  # no cursor is held open between chunks, so callers may commit in between
+            query = model.query.order_by(key)
+            if last is not None:
+                query = query.filter(key > last)
+            chunk = query.limit(chunk_size).all()
+            if not chunk:
+                break
+            last = getattr(chunk[-1], key.key)
+            yield [document_for(obj) for obj in chunk]
+
+
+def _marked(value):  # escape user content, then turn the sentinels into <mark> tags
+    return Markup(str(escape(value)).replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>'))
+
+
+def highlight(value, terms, width=None):  # pure-python stand-in for fts5's snippet()
+    value = value or ''
+    if not terms:
+        return _marked(value[:width] if width else value)
+    pattern = re.compile(r'\b(' + '|'.join(re.escape(t) for t in sorted(terms, key=len, reverse=True)) + r')\w*',
+                         re.IGNORECASE | re.UNICODE)
+    if width and len(value) > width:
+        first = pattern.search(value)
+        start = max(0, (first.start() if first else 0) - width // 4)
+        value = ('…' if start else '') + value[start:start + width] + ('…' if start + width < len(value) else '')
+    return _marked(pattern.sub(lambda m: _OPEN + m.group(0) + _CLOSE, value))
+
+
+def document_ids(kind, refs=(), parents=()):  # index rows for these refs, or for every child of these parents
+    query = db.session.query(SearchDocument.id).filter_by(kind=kind)
+    if refs:
+        query = query.filter(SearchDocument.ref.in_([str(ref) for ref in refs]))
+    else:
+        query = query.filter(SearchDocument.parent.in_([str(parent) for parent in parents]))
+    return [i for i, in query]
+
+
+class SearchHit:
+    def __init__(self, kind, ref, parent, title, snippet):
+        self.kind = kind
+        self.ref = ref
+        self.parent = parent  # id of the pattern a section belongs to
+        self.title = title  # Markup with matches highlighted
+        self.snippet = snippet
+        self.pattern = None  # (slug, title) of the pattern, filled in for pattern and section hits
+
+
+def attach_patterns(hits):  # look up the slugs pattern and section links need, one query per page of hits
+    ids = {int(hit.ref if hit.kind == 'pattern' else hit.parent) for hit in hits if hit.kind != 'post'}
+    if not ids:
+        return
+    found = {i: (slug, title) for i, slug, title in
+             db.session.query(Pattern.id, Pattern.slug, Pattern.title).filter(Pattern.id.in_(ids))}
+    for hit in hits:
+        if hit.kind != 'post':
+            hit.pattern = found.get(int(hit.ref if hit.kind == 'pattern' else hit.parent))
+
+
+class SearchResults:  # one page of ranked hits. we fetch one extra row instead of counting every match
+    def __init__(self, query, items, page, per_page, has_next):
+        self.query = query
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.has_next = has_next
+        self.has_prev = page > 1
+
+
+def inserted_ids(docs):  # {(kind, ref): id} of rows just bulk inserted, the database hands out the ids
+    rows = db.session.query(SearchDocument.kind, SearchDocument.ref, SearchDocument.id) \
+        .filter(SearchDocument.kind.in_({doc['kind'] for doc in docs}),
+                SearchDocument.ref.in_([doc['ref'] for doc in docs]))
+    return {(kind, ref): i for kind, ref, i in rows}
+
+
+class InvertedIndexBackend:  # works on any database: postings in search_term, bm25 ranking in python
+    name = 'inverted'
+    k1 = 1.2
+    b = 0.75
+
+    def ensure_schema(self, conn):
+        SearchDocument.__table__.create(conn, checkfirst=True)
+        SearchTerm.__table__.create(conn, checkfirst=True)
+
+    @staticmethod
+    def frequencies(doc):  # (term frequencies, document length). tokens sharing a MAX_TERM prefix count as one
+        title_terms = tokenize(doc['title'])
+        content_terms = tokenize(doc['content'])
+        frequencies = Counter(term[:MAX_TERM] for term in content_terms)
+        for term in title_terms:
+            frequencies[term[:MAX_TERM]] += TITLE_WEIGHT
+        return frequencies, len(content_terms) + TITLE_WEIGHT * len(title_terms)
+
+    def add(self, doc):
+        self.remove(doc['kind'], refs=[doc['ref']])
+        frequencies, length = self.frequencies(doc)
+        row = SearchDocument(kind=doc['kind'], ref=doc['ref'], parent=doc['parent'], title=doc['title'],
+                             content=doc['content'], length=length)
+        db.session.add(row)
+        db.session.flush()
+        db.session.bulk_insert_mappings(SearchTerm, [dict(term=term, document_id=row.id, frequency=n)
+                                                     for term, n in frequencies.items()])
+
+    def add_many(self, docs):  # bulk load into an empty index
+        counted = [self.frequencies(doc) for doc in docs]
+        db.session.bulk_insert_mappings(SearchDocument, [
+            dict(kind=doc['kind'], ref=doc['ref'], parent=doc['parent'], title=doc['title'], content=doc['content'],
+                 length=length) for doc, (_, length) in zip(docs, counted)])
+        ids = inserted_ids(docs)
+        db.session.bulk_insert_mappings(SearchTerm, [
+            dict(term=term, document_id=ids[(doc['kind'], doc['ref'])], frequency=n)
+            for doc, (frequencies, _) in zip(docs, counted) for term, n in frequencies.items()])
+
+    def remove(self, kind, refs=(), parents=()):
+        ids = document_ids(kind, refs, parents)
+        if ids:
+            SearchTerm.query.filter(SearchTerm.document_id.in_(ids)).delete(synchronize_session=False)
+            SearchDocument.query.filter(SearchDocument.id.in_(ids)).delete(synchronize_session=False)
+
+    def clear(self):
+        SearchTerm.query.delete(synchronize_session=False)
+        SearchDocument.query.delete(synchronize_session=False)
+
+    def optimize(self):
+        pass
+
+    def search(self, query, page, per_page):
+        terms = sorted({term[:MAX_TERM] for term in tokenize(query)})
+        if not terms:
+            return [], False
+        postings = db.session.query(SearchTerm.term, SearchTerm.document_id, SearchTerm.frequency,
+                                    SearchDocument.length) \
+            .join(SearchDocument, SearchDocument.id == SearchTerm.document_id) \
+            .filter(SearchTerm.term.in_(terms)).all()
+        by_document = {}
+        lengths = {}
+        document_frequency = Counter()
+        for term, document_id, frequency, length in postings:
+            by_document.setdefault(document_id, {})[term] = frequency
+            lengths[document_id] = length
+            document_frequency[term] += 1
+        matches = {d: f for d, f in by_document.items() if len(f) == len(terms)}  # every term must match
+        if not matches:
+            return [], False
+
+        total, average_length = db.session.query(db.func.count(SearchDocument.id),
+                                                 db.func.avg(SearchDocument.length)).one()
+        average_length = float(average_length or 1)
+        scores = {}
+        for document_id, frequencies in matches.items():
+            norm = self.k1 * (1 - self.b + self.b * lengths.get(document_id, 0) / average_length)
+            score = 0.0
+            for term, frequency in frequencies.items():
+                idf = math.log(1 + (total - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+                score += idf * frequency * (self.k1 + 1) / (frequency + norm)
+            scores[document_id] = score
+
+        ranked = sorted(scores, key=lambda d: (-scores[d], d))
+        start = (page - 1) * per_page
+        window = ranked[start:start + per_page]
+        documents = {d.id: d for d in SearchDocument.query.filter(SearchDocument.id.in_(window))}
+        hits = [SearchHit(d.kind, d.ref, d.parent, highlight(d.title, terms), highlight(d.content, terms, width=200))
+                for d in (documents[i] for i in window if i in documents)]
+        return hits, len(ranked) > start + per_page
+
+
+class Fts5Backend:  # sqlite's own full-text index, ranked with its bm25() and highlighted with snippet()
+    name = 'fts5'
+
+    def ensure_schema(self, conn):
+        SearchDocument.__table__.create(conn, checkfirst=True)
+        conn.execute(text("CREATE VIRTUAL TABLE IF NOT EXISTS search_fts "  # rowid is search_document.id
+                          "USING fts5(title, content, tokenize='porter unicode61')"))
+
+    def add(self, doc):
+        row = SearchDocument.query.filter_by(kind=doc['kind'], ref=doc['ref']).first()
+        if row is None:
+            row = SearchDocument(kind=doc['kind'], ref=doc['ref'])
+            db.session.add(row)
+        row.parent = doc['parent']
+        row.title = doc['title']
+        db.session.flush()
+        db.session.execute(text('DELETE FROM search_fts WHERE rowid = :id'), {'id': row.id})
+        db.session.execute(text('INSERT INTO search_fts (rowid, title, content) VALUES (:id, :title, :content)'),
+                           {'id': row.id, 'title': doc['title'], 'content': doc['content']})
+
+    def add_many(self, docs):  # bulk load into an empty index
+        db.session.bulk_insert_mappings(SearchDocument, [dict(kind=doc['kind'], ref=doc['ref'], parent=doc['parent'],
+                                                              title=doc['title'], length=0) for doc in docs])
+        ids = inserted_ids(docs)
+        db.session.execute(text('INSERT INTO search_fts (rowid, title, content) VALUES (:id, :title, :content)'),
+                           [{'id': ids[(doc['kind'], doc['ref'])], 'title': doc['title'], 'content': doc['content']}
+                            for doc in docs])
+
+    def remove(self, kind, refs=(), parents=()):
+        ids = document_ids(kind, refs, parents)
+        if ids:
+            db.session.execute(text('DELETE FROM search_fts WHERE rowid = :id'), [{'id': i} for i in ids])
+            SearchDocument.query.filter(SearchDocument.id.in_(ids)).delete(synchronize_session=False)
+
+    def clear(self):
+        db.session.execute(text('DELETE FROM search_fts'))
+        SearchDocument.query.delete(synchronize_session=False)
+
+    def optimize(self):
+        db.session.execute(text("INSERT INTO search_fts (search_fts) VALUES ('optimize')"))
+
+    def search(self, query, page, per_page):
+        terms = tokenize(query)
+        if not terms:
+            return [], False
+        match = ' '.join('"' + term.replace('"', '') + '"' for term in terms)  # quoted terms, implicit AND
+        rows = db.session.execute(text(
+            "SELECT d.kind, d.ref, d.parent, "
+            "highlight(search_fts, 0, :open, :close), snippet(search_fts, 1, :open, :close, '…', 32) "
+            "FROM search_fts JOIN search_document d ON d.id = search_fts.rowid "
+            "WHERE search_fts MATCH :match ORDER BY bm25(search_fts, 10.0, 1.0) LIMIT :limit OFFSET :offset"),
+            {'open': _OPEN, 'close': _CLOSE, 'match': match,
+             'limit': per_page + 1, 'offset': (page - 1) * per_page}).fetchall()
+        hits = [SearchHit(kind, ref, parent, _marked(title), _marked(snippet))
+                for kind, ref, parent, title, snippet in rows[:per_page]]
+        return hits, len(rows) > per_page
+
+
+def fts5_available(engine):
+    if engine.dialect.name != 'sqlite':
+        return False
+    with engine.connect() as conn:
+        options = [row[0] for row in conn.execute(text('PRAGMA compile_options'))]
+    return 'ENABLE_FTS5' in options
+
+
+class SearchIndex:  # keeps posts, patterns and sections searchable. routes call add/remove before committing
+    def __init__(self, app=None):
+        self._backends = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SEARCH_BACKEND', 'auto')  # 'auto', 'fts5' or 'inverted'
+        app.config.setdefault('SEARCH_PER_PAGE', 10)
+        app.extensions['search_index'] = self
+        app.before_first_request(lambda: self.backend)  # create the index tables before any request holds a lock
+
+    @property
+    def backend(self):  # picked once per engine, the first time the index is used
+        engine = db.engine
+        backend = self._backends.get(engine)
+        if backend is None:
+            choice = current_app.config['SEARCH_BACKEND']
+            if choice == 'auto':
+                choice = 'fts5' if fts5_available(engine) else 'inverted'
+            backend = Fts5Backend() if choice == 'fts5' else InvertedIndexBackend()
+            with engine.begin() as conn:
+                backend.ensure_schema(conn)
+            self._backends[engine] = backend
+        return backend
+
+    def add(self, obj):
+        db.session.flush()  # new rows need their primary key before we can index them
+        self.backend.add(document_for(obj))
+
+    def remove(self, obj):
+        doc = document_for(obj)
+        self.backend.remove(doc['kind'], refs=[doc['ref']])
+
+    def remove_posts(self, post_ids):  # bulk deletes, a few statements whatever the number of posts
+        self.backend.remove('post', refs=post_ids)
+
+    def remove_pattern(self, pattern_id):  # a pattern and all of its sections
+        self.remove_patterns([pattern_id])
+
+    def remove_patterns(self, pattern_ids):
+        self.backend.remove('section', parents=pattern_ids)
+        self.backend.remove('pattern', refs=pattern_ids)
+
+    def search(self, query, page=1, per_page=10):
+        hits, has_next = self.backend.search(query, page, per_page)
+        attach_patterns(hits)
+        return SearchResults(query, hits, page, per_page, has_next)
+
+    def rebuild(self, chunk_size=500, progress=None):  # drop and refill the whole index, one transaction per chunk
+        backend = self.backend
+        backend.clear()
+        db.session.commit()
+        count = 0
+        for docs in iter_document_chunks(chunk_size):
+            backend.add_many(docs)
+            db.session.commit()
+            count += len(docs)
+            if progress:
+                progress(count)
+        backend.optimize()
+        db.session.commit()
+        return count
+
+
+search_index = SearchIndex()
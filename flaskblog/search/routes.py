@@ -0,0 +1,21 @@
+import click
+from flask import render_template, request, Blueprint, current_app
+from flaskblog.search.index import search_index
+
+search = Blueprint('search', __name__)
+
+
+@search.route("/search")
+def results():
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    hits = search_index.search(query, page=page, per_page=current_app.config['SEARCH_PER_PAGE']) if query else None
+    return render_template('search.html', title='Search', query=query, hits=hits)
+
+
+@search.cli.command('reindex')
+@click.option('--chunk-size', default=500, show_default=True, help='Rows indexed per transaction.')
+def reindex(chunk_size):  # flask search reindex: rebuild the whole index from posts, patterns and sections
+    click.echo(f'Rebuilding the {search_index.backend.name} search index...')
+    count = search_index.rebuild(chunk_size=chunk_size, progress=lambda n: click.echo(f'  {n} documents'))
+    click.echo(f'Indexed {count} documents.')
@@ -0,0 +1,57 @@
+// Section bodies on the pattern page are fetched when opened. Everything opened in the same tick
+// goes out as one request to patterns.section_bodies.
+(function () {
+  var queue = {}, timer = null;
+
+  function flush() {
+    timer = null;
+    var bodies = queue;
+    queue = {};
+    var ids = Object.keys(bodies);
+    if (!ids.length) return;
+    var src = bodies[ids[0]].getAttribute('data-src');
+    for (var i = 0; i < ids.length; i += 50) {  // SECTION_BATCH_LIMIT in patterns/routes.py
+      request(src, ids.slice(i, i + 50), bodies);
+    }
+  }
+
+  function request(src, ids, bodies) {
+    fetch(src + '?ids=' + ids.join(','), {credentials: 'same-origin'})
+      .then(function (response) {
+        if (!response.ok) throw new Error(response.status);
+        return response.json();
+      })
+      .then(function (data) {
+        data.sections.forEach(function (section) {
+          var body = bodies[section.id];
+          body.innerHTML = section.html;  // sanitised when the section was saved
+          body.setAttribute('data-loaded', '1');
+        });
+      })
+      .catch(function () {
+        ids.forEach(function (id) {
+          bodies[id].textContent = 'Could not load this section, please try again.';
+          bodies[id].removeAttribute('data-requested');
+        });
+      });
+  }
+
+  function load(id) {
+    var body = document.querySelector('[data-section-body="' + id + '"]');
+    if (!body || body.hasAttribute('data-requested')) return;
+    body.setAttribute('data-requested', '1');
+    queue[id] = body;
+    if (timer === null) timer = setTimeout(flush, 0);
+  }
+
+  document.addEventListener('click', function (event) {
+    var toggle = event.target.closest('[data-section-id]');
+    if (toggle) load(toggle.getAttribute('data-section-id'));
+    if (event.target.closest('[data-expand-all]')) {
+      document.querySelectorAll('[data-section-id]').forEach(function (el) {
+        load(el.getAttribute('data-section-id'));
+      });
+      if (window.jQuery) window.jQuery('.collapse[id^="collapse"]').collapse('show');
+    }
+  });
+})();
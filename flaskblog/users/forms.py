@@ -57,6 +57,21 @@ class UpdateAccountForm(FlaskForm):
             if user:
                 raise ValidationError('That email is taken. Please choose a different one.')
 
+    def validate_picture(self, picture):  # here, so a broken file is an error now rather than a default avatar later
+        if not picture.data:
+            return
+        from PIL import Image  # only uploads need pillow, not every worker at boot
+        try:
+            with Image.open(picture.data.stream) as image:
+                image_format = image.format
+                image.verify()
+        except Exception:  # pillow raises all sorts for truncated, corrupt or oversized files
+            image_format = None
+        finally:
+            picture.data.stream.seek(0)  # save_picture reads it again
+        if image_format not in ('JPEG', 'PNG'):
+            raise ValidationError('That file is not a readable JPG or PNG image.')
+
 
 class RequestResetForm(FlaskForm):
     email = StringField('Email',
@@ -0,0 +1,101 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flaskblog import bcrypt
+from flaskblog.metrics import track
+
+
+class HasherBusy(Exception):  # too many hashes already queued, the caller should answer 503
+    pass
+
+
+def hash_rounds(pw_hash):  # cost factor stored in a bcrypt hash: $2b$12$... -> 12
+    try:
+        return int(pw_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:  # runs bcrypt on a small bounded pool so a burst of logins can't take every worker thread
+    def __init__(self, app=None):
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self.rounds = 12
+        self.queue_timeout = 5
+        self.in_flight = 0  # hashes running right now
+        self.queued = 0  # admitted, waiting for a pool thread
+        self.max_queued = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0  # total time spent queued
+        self.hash_seconds = 0.0  # total time spent inside bcrypt
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('BCRYPT_LOG_ROUNDS', 12)  # same key flask_bcrypt reads
+        app.config.setdefault('BCRYPT_MAX_CONCURRENCY', os.cpu_count() or 1)  # 0 hashes inline on the caller
+        app.config.setdefault('BCRYPT_MAX_QUEUE', 32)  # waiting hashes before we start turning requests away
+        app.config.setdefault('BCRYPT_QUEUE_TIMEOUT', 5)  # seconds to wait for a queue slot
+        self.rounds = app.config['BCRYPT_LOG_ROUNDS']
+        self.queue_timeout = app.config['BCRYPT_QUEUE_TIMEOUT']
+        workers = app.config['BCRYPT_MAX_CONCURRENCY']
+        if workers:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+            self._slots = threading.BoundedSemaphore(workers + app.config['BCRYPT_MAX_QUEUE'])
+        app.extensions['password_hasher'] = self
+
+    def _timed(self, func, args, enqueued):
+        started = time.perf_counter()
+        with self._lock:
+            self.queued -= 1
+            self.in_flight += 1
+            self.wait_seconds += started - enqueued
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+                self.hash_seconds += time.perf_counter() - started
+
+    def _run(self, func, *args):
+        with track('bcrypt'):  # queueing included, that's time the request spent waiting too
+            return self._submit(func, *args)
+
+    def _submit(self, func, *args):
+        if self._executor is None:
+            with self._lock:
+                self.queued += 1
+            return self._timed(func, args, time.perf_counter())
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self.rejected += 1
+            raise HasherBusy()
+        try:
+            with self._lock:
+                self.queued += 1
+                self.max_queued = max(self.max_queued, self.queued)
+            return self._executor.submit(self._timed, func, args, time.perf_counter()).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(bcrypt.generate_password_hash, password, self.rounds).decode('utf-8')
+
+    def check(self, pw_hash, password):
+        return self._run(bcrypt.check_password_hash, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):  # true when the hash was made with a different cost than configured
+        return hash_rounds(pw_hash) != self.rounds
+
+    def stats(self):
+        with self._lock:
+            return dict(in_flight=self.in_flight, queued=self.queued, max_queued=self.max_queued,
+                        completed=self.completed, rejected=self.rejected,
+                        wait_seconds=self.wait_seconds, hash_seconds=self.hash_seconds)
+
+
+hasher = PasswordHasher()
@@ -1,13 +1,20 @@
-from flask import render_template, url_for, flash, redirect, request, Blueprint
+import os
+import click
+from flask import (render_template, url_for, flash, redirect, request, Blueprint,
+                   abort, current_app, send_from_directory)
 from flask_login import login_user, current_user, logout_user, login_required
-from flaskblog import db, bcrypt
-from flaskblog.models import User, Post
+from flaskblog import db, page_cache
+from flaskblog.models import User, invalidate_user
+from flaskblog.posts.utils import paginate_feed
 from flaskblog.users.forms import (RegistrationForm, LoginForm, UpdateAccountForm,
                                    RequestResetForm, ResetPasswordForm)
-from flaskblog.users.utils import save_picture, send_reset_email
+from flaskblog.users.passwords import hasher
+from flaskblog.users.utils import (save_picture, send_reset_email, avatar_url, avatar_folder, delete_avatar,
+                                   collect_orphaned_avatars, AVATAR_DIGEST, AVATAR_SIZES)
 
 
 users = Blueprint('users', __name__)
+users.add_app_template_global(avatar_url)
 
 
 @users.route("/register", methods=['GET', 'POST'])
@@ -16,7 +23,7 @@ def register():
         return redirect(url_for('main.home'))
     form = RegistrationForm()  # create the registration form
     if form.validate_on_submit():  # validate the user input upon submitting
-        hashed_password = bcrypt.generate_password_hash(form.password.data).decode('UTF-8')  # hash the user password
+        hashed_password = hasher.hash(form.password.data)  # hash the user password on the bounded bcrypt pool
         user = User(username=form.username.data, email=form.email.data, password=hashed_password)  # create this user
         db.session.add(user)  # prepare to add this user to the db
         db.session.commit()  # commit/add this user to the db
@@ -32,7 +39,10 @@ def login():
     form = LoginForm()  # create the login form
     if form.validate_on_submit():  # validate the user input upon submitting
         user = User.query.filter_by(email=form.email.data).first()  # get the info of the user with that email
-        if user and bcrypt.check_password_hash(user.password, form.password.data):  # compare the passwords
+        if user and hasher.check(user.password, form.password.data):  # compare the passwords
+            if hasher.needs_rehash(user.password):  # BCRYPT_LOG_ROUNDS changed since this hash was made
+                user.password = hasher.hash(form.password.data)
+                db.session.commit()
             login_user(user, remember=form.remember.data)  # log in user and check if they wanted to be remembered
             next_page = request.args.get('next')  # if they needed to log in to view a page, redirect after log in
             return redirect(next_page) if next_page else redirect(url_for('main.home'))  # upon success, send them home
@@ -52,31 +62,60 @@ def logout():
 def account():
     form = UpdateAccountForm()
     if form.validate_on_submit():  # this section lets the user update their picture, username, and email
+        user = User.query.get(current_user.id)  # current_user is a cached read-only copy, change the real row
+        old_picture = user.image_file
         if form.picture.data:
             picture_file = save_picture(form.picture.data)
-            current_user.image_file = picture_file
-        current_user.username = form.username.data
-        current_user.email = form.email.data
+            user.image_file = picture_file
+        user.username = form.username.data
+        user.email = form.email.data
         db.session.commit()
+        invalidate_user(user.id)
+        if old_picture != user.image_file and not User.query.filter_by(image_file=old_picture).first():
+            delete_avatar(old_picture)  # nobody else uploaded the same picture, so it's an orphan now
+        page_cache.invalidate('main.home')  # the feed shows usernames and profile pictures
         flash('Your account has been updated!', 'success')
         return redirect(url_for('users.account'))
     elif request.method == 'GET':  # this section auto populates the username and email forms
         form.username.data = current_user.username
         form.email.data = current_user.email
-    image_file = url_for('static', filename='profile_pics/' + current_user.image_file)  # show the user's profile pic
+    image_file = avatar_url(current_user.image_file, 125)  # show the user's profile pic
     return render_template('account.html', title='Account', image_file=image_file, form=form)
 
 
 @users.route("/user/<string:username>")
 def user_posts(username):
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     user = User.query.filter_by(username=username).first_or_404()
-    posts = Post.query.filter_by(author=user)\
-        .order_by(Post.date_posted.desc())\
-        .paginate(page=page, per_page=5)  # filter by author, descending order, 5 per page
+    posts = paginate_feed(cursor=cursor, author=user, per_page=5)  # filter by author, newest first, 5 per page
     return render_template('user_posts.html', posts=posts, user=user)
 
 
+@users.route("/avatars/<string:digest>-<int:size>")
+def avatar(digest, size):  # content addressed, so a url never changes meaning and can be cached forever
+    if not AVATAR_DIGEST.match(digest) or size not in AVATAR_SIZES:
+        abort(404)
+    # only when it is named, */* and image/* also match webp but come from clients that may not decode it
+    webp = any(value == 'image/webp' and quality > 0 for value, quality in request.accept_mimetypes)
+    name = f"{digest}-{size}.{'webp' if webp else 'jpg'}"
+    if not os.path.exists(os.path.join(avatar_folder(), name)):  # still being processed (or it failed)
+        response = send_from_directory(avatar_folder(), 'default.jpg', cache_timeout=0)
+        response.headers['Cache-Control'] = 'no-cache'
+    else:
+        response = send_from_directory(avatar_folder(), name, cache_timeout=current_app.config['AVATAR_MAX_AGE'])
+        response.headers['Cache-Control'] = f"public, max-age={current_app.config['AVATAR_MAX_AGE']}, immutable"
+    response.vary.add('Accept')
+    return response
+
+
+@users.cli.command('gc-avatars')
+@click.option('--grace', default=3600, show_default=True, help='Keep files younger than this many seconds.')
+def gc_avatars(grace):  # flask users gc-avatars: delete profile pictures no user references
+    referenced = {image_file for image_file, in db.session.query(User.image_file).distinct()}
+    removed = collect_orphaned_avatars(referenced, grace=grace)
+    click.echo(f'Removed {len(removed)} orphaned avatar files.')
+
+
 @users.route("/reset_password", methods=['GET', 'POST'])
 def reset_request():
     if current_user.is_authenticated:  # if the user is logged in and tries to reset password, redirect home
@@ -100,9 +139,10 @@ def reset_token(token):
         return redirect(url_for('users.reset_request'))
     form = ResetPasswordForm()
     if form.validate_on_submit():  # validate the user input upon submitting
-        hashed_password = bcrypt.generate_password_hash(form.password.data).decode('UTF-8')  # hash the user password
+        hashed_password = hasher.hash(form.password.data)  # hash the user password
         user.password = hashed_password
         db.session.commit()  # commit this new password to the database
+        invalidate_user(user.id)
         flash(f'Your password has been updated!', 'success')  # display a message for successful submit
         return redirect(url_for('users.login'))  # redirect the user after a successful submit
     return render_template('reset_token.html', title='Reset Password', form=form)
@@ -1,23 +1,113 @@
+import hashlib
+import logging
+import multiprocessing
 import os
-import secrets
-from PIL import Image
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
 from flask import url_for, current_app
 from flask_mail import Message
-from flaskblog import mail
+from flaskblog.outbox import outbox
 
+logger = logging.getLogger(__name__)
 
-def save_picture(form_picture):  # save the picture to our picture folder as a random hex
-    random_hex = secrets.token_hex(8)
-    _, f_ext = os.path.splitext(form_picture.filename)
-    picture_fn = random_hex + f_ext
-    picture_path = os.path.join(current_app.root_path, 'static/profile_pics', picture_fn)
+AVATAR_SIZES = (40, 64, 125)  # feed, post page and account page
+AVATAR_FORMATS = (('webp', 'WEBP', dict(quality=80, method=4)), ('jpg', 'JPEG', dict(quality=85, optimize=True)))
+AVATAR_DIGEST = re.compile(r'^[0-9a-f]{16}$')  # avatars are named after the sha256 of the upload
+AVATAR_FILE = re.compile(r'^([0-9a-f]{16})-(\d+)\.(webp|jpg)$')
+_pool = None
 
-    output_size = (125, 125)  # resize the image before saving
-    i = Image.open(form_picture)
-    i.thumbnail(output_size)
-    i.save(picture_path)
 
-    return picture_fn
+def avatar_folder():
+    return os.path.join(current_app.root_path, 'static/profile_pics')
+
+
+def avatar_path(digest, size, ext):
+    return os.path.join(avatar_folder(), f'{digest}-{size}.{ext}')
+
+
+def render_avatar_variants(source_path, folder, digest, sizes=AVATAR_SIZES):  # runs in the process pool
+    from PIL import Image, ImageOps
+    with Image.open(source_path) as original:
+        image = ImageOps.exif_transpose(original).convert('RGB')
+        for size in sizes:
+            thumb = ImageOps.fit(image, (size, size), Image.LANCZOS)  # square crop, shown in a circle anyway
+            for ext, fmt, options in AVATAR_FORMATS:
+                final = os.path.join(folder, f'{digest}-{size}.{ext}')
+                partial = f'{final}.{os.getpid()}.tmp'
+                thumb.save(partial, fmt, **options)
+                os.replace(partial, final)  # readers never see half a file
+    os.remove(source_path)
+    return digest
+
+
+def _log_failure(future):
+    if future.exception() is not None:
+        logger.error('avatar processing failed', exc_info=future.exception())
+
+
+def avatar_pool():
+    global _pool
+    if _pool is None:
+        # spawned, not forked: a fork of this threaded server would copy whatever locks and pooled database
+        # connections other threads held at that moment
+        _pool = ProcessPoolExecutor(max_workers=current_app.config['AVATAR_WORKERS'],
+                                    mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def save_picture(form_picture):  # store the upload under its content hash and resize it off the request
+    data = form_picture.read()
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    folder = avatar_folder()
+    if all(os.path.exists(avatar_path(digest, size, ext)) for size in AVATAR_SIZES for ext, _, _ in AVATAR_FORMATS):
+        return digest  # somebody already uploaded this exact picture
+    incoming = os.path.join(folder, 'incoming')
+    os.makedirs(incoming, exist_ok=True)
+    source_path = os.path.join(incoming, f'{digest}.{os.getpid()}.{time.monotonic_ns()}')
+    with open(source_path, 'wb') as f:
+        f.write(data)
+    avatar_pool().submit(render_avatar_variants, source_path, folder, digest).add_done_callback(_log_failure)
+    return digest
+
+
+def avatar_url(image_file, size):  # url of the smallest variant that covers `size` pixels
+    if not AVATAR_DIGEST.match(image_file or ''):  # default.jpg and pictures saved before avatars were hashed
+        return url_for('static', filename='profile_pics/' + (image_file or 'default.jpg'))
+    size = next((s for s in AVATAR_SIZES if s >= size), AVATAR_SIZES[-1])
+    return url_for('users.avatar', digest=image_file, size=size)
+
+
+def delete_avatar(image_file):  # remove every variant of a picture nobody uses any more
+    if not AVATAR_DIGEST.match(image_file or ''):
+        return
+    for size in AVATAR_SIZES:
+        for ext, _, _ in AVATAR_FORMATS:
+            try:
+                os.remove(avatar_path(image_file, size, ext))
+            except FileNotFoundError:
+                pass
+
+
+def collect_orphaned_avatars(referenced, grace=3600):  # delete avatar files no user points at, returns the names
+    folder = avatar_folder()
+    incoming = os.path.join(folder, 'incoming')
+    candidates = [(folder, name) for name in os.listdir(folder)]
+    if os.path.isdir(incoming):  # uploads whose processing died
+        candidates += [(incoming, name) for name in os.listdir(incoming)]
+    cutoff = time.time() - grace  # leave fresh files alone, their account update may not be committed yet
+    removed = []
+    for directory, name in candidates:
+        path = os.path.join(directory, name)
+        if not os.path.isfile(path) or name == 'default.jpg' or os.path.getmtime(path) > cutoff:
+            continue
+        if directory == folder:
+            match = AVATAR_FILE.match(name)
+            if (match.group(1) if match else name) in referenced:
+                continue
+        os.remove(path)
+        removed.append(name)
+    return removed
 
 
 def send_reset_email(user):
@@ -30,4 +120,4 @@ def send_reset_email(user):
 
 If you did not make this request, then simply ignore this email and no changes will be made.
     '''
-    mail.send(msg)
+    outbox.enqueue(msg)  # delivered by the outbox worker, the request doesn't wait on smtp
@@ -0,0 +1,180 @@
+"""baseline schema, upgrading pre-slug pattern tables
+
+Creates any table that is missing, so it works on an empty database as well as on an existing
+site.db. Databases from before patterns had a surrogate key get their pattern and section tables
+rebuilt: every id is kept, the old unique sort number becomes both the new key and the position,
+slugs are derived from titles and sections are reattached by their old pattern title.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+import re
+import unicodedata
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def slugify(title):
+    value = unicodedata.normalize('NFKD', title or '').encode('ascii', 'ignore').decode('ascii')
+    value = re.sub(r'[^a-z0-9]+', '-', value.lower()).strip('-')
+    return value[:90] or 'pattern'
+
+
+def create_pattern_tables():
+    op.create_table(
+        'pattern',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('position', sa.Integer(), nullable=False),
+        sa.Column('title', sa.String(length=100), nullable=False),
+        sa.Column('slug', sa.String(length=100), nullable=False),
+        sa.Column('content', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('title'),
+    )
+    op.create_index('ix_pattern_position', 'pattern', ['position'])
+    op.create_index('ix_pattern_slug', 'pattern', ['slug'], unique=True)
+    op.create_table(
+        'section',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('title', sa.String(length=100), nullable=False),
+        sa.Column('content', sa.Text(), nullable=False),
+        sa.Column('pattern_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['pattern_id'], ['pattern.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_section_pattern_id_id', 'section', ['pattern_id', 'id'])
+
+
+def upgrade_legacy_patterns(bind):
+    op.rename_table('section', 'section_legacy')
+    op.rename_table('pattern', 'pattern_legacy')
+    create_pattern_tables()
+
+    ids_by_title, slugs, patterns = {}, set(), []
+    for old_id, title, content in bind.execute(sa.text('SELECT id, title, content FROM pattern_legacy ORDER BY id')):
+        base = slug = slugify(title)
+        n = 2
+        while slug in slugs:
+            slug, n = f'{base}-{n}', n + 1
+        slugs.add(slug)
+        ids_by_title[title] = old_id
+        patterns.append(dict(id=old_id, position=old_id, title=title, slug=slug, content=content))
+    pattern_table = sa.table('pattern', sa.column('id'), sa.column('position'), sa.column('title'),
+                             sa.column('slug'), sa.column('content'))
+    if patterns:
+        op.bulk_insert(pattern_table, patterns)
+
+    sections = []
+    for section_id, title, content, pattern_title in bind.execute(
+            sa.text('SELECT id, title, content, pattern_title FROM section_legacy ORDER BY id')):
+        if pattern_title in ids_by_title:  # sections of renamed or deleted patterns have nothing to attach to
+            sections.append(dict(id=section_id, title=title, content=content, pattern_id=ids_by_title[pattern_title]))
+    section_table = sa.table('section', sa.column('id'), sa.column('title'), sa.column('content'),
+                             sa.column('pattern_id'))
+    if sections:
+        op.bulk_insert(section_table, sections)
+
+    op.drop_table('section_legacy')
+    op.drop_table('pattern_legacy')
+
+
+def upgrade():
+    bind = op.get_bind()
+    tables = set(sa.inspect(bind).get_table_names())
+
+    if 'user' not in tables:
+        op.create_table(
+            'user',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('username', sa.String(length=20), nullable=False),
+            sa.Column('email', sa.String(length=120), nullable=False),
+            sa.Column('image_file', sa.String(length=20), nullable=False),
+            sa.Column('password', sa.String(length=60), nullable=False),
+            sa.Column('role', sa.String(length=20), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('email'),
+            sa.UniqueConstraint('username'),
+        )
+    if 'post' not in tables:
+        op.create_table(
+            'post',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('title', sa.String(length=100), nullable=False),
+            sa.Column('date_posted', sa.DateTime(), nullable=False),
+            sa.Column('content', sa.Text(), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+            sa.PrimaryKeyConstraint('id'),
+        )
+
+    if 'pattern' not in tables:
+        if 'section' in tables:
+            op.drop_table('section')  # sections can't exist without their patterns
+        create_pattern_tables()
+    elif 'slug' not in {c['name'] for c in sa.inspect(bind).get_columns('pattern')}:
+        upgrade_legacy_patterns(bind)
+
+    if 'search_document' not in tables:
+        op.create_table(
+            'search_document',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('kind', sa.String(length=20), nullable=False),
+            sa.Column('ref', sa.String(length=100), nullable=False),
+            sa.Column('parent', sa.String(length=100), nullable=True),
+            sa.Column('title', sa.String(length=100), nullable=False),
+            sa.Column('content', sa.Text(), nullable=True),
+            sa.Column('length', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('kind', 'ref'),
+        )
+        op.create_index('ix_search_document_kind_parent', 'search_document', ['kind', 'parent'])
+    if 'search_term' not in tables:
+        op.create_table(
+            'search_term',
+            sa.Column('term', sa.String(length=64), nullable=False),
+            sa.Column('document_id', sa.Integer(), nullable=False),
+            sa.Column('frequency', sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(['document_id'], ['search_document.id']),
+            sa.PrimaryKeyConstraint('term', 'document_id'),
+        )
+        op.create_index('ix_search_term_document_id', 'search_term', ['document_id'])
+    if 'outbox_message' not in tables:
+        op.create_table(
+            'outbox_message',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('subject', sa.String(length=200), nullable=False),
+            sa.Column('sender', sa.String(length=120), nullable=False),
+            sa.Column('recipients', sa.Text(), nullable=False),
+            sa.Column('body', sa.Text(), nullable=True),
+            sa.Column('html', sa.Text(), nullable=True),
+            sa.Column('status', sa.String(length=10), nullable=False),
+            sa.Column('attempts', sa.Integer(), nullable=False),
+            sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+            sa.Column('claimed_by', sa.String(length=32), nullable=True),
+            sa.Column('claimed_at', sa.DateTime(), nullable=True),
+            sa.Column('last_error', sa.Text(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=False),
+            sa.Column('sent_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index('ix_outbox_message_status_next_attempt_at', 'outbox_message',
+                        ['status', 'next_attempt_at'])
+
+
+def downgrade():
+    op.drop_table('outbox_message')
+    op.drop_table('search_term')
+    op.drop_table('search_document')
+    op.drop_table('section')
+    op.drop_table('pattern')
+    op.drop_table('post')
+    op.drop_table('user')
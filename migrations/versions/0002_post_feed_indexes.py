@@ -0,0 +1,34 @@
+"""indexes for the home and author post feeds
+
+The home page orders every post by (date_posted, id) and the author page filters by user_id before
+ordering by date, so without these both scan the whole post table and sort it.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 09:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+INDEXES = (('ix_post_date_posted_id', ['date_posted', 'id']),
+           ('ix_post_user_id_date_posted', ['user_id', 'date_posted']))
+
+
+def upgrade():
+    existing = {ix['name'] for ix in sa.inspect(op.get_bind()).get_indexes('post')}
+    for name, columns in INDEXES:
+        if name not in existing:  # databases made by db.create_all() already have them
+            op.create_index(name, 'post', columns)
+
+
+def downgrade():
+    for name, _ in INDEXES:
+        op.drop_index(name, table_name='post')
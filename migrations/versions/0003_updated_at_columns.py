@@ -0,0 +1,41 @@
+"""updated_at on post, pattern and section for conditional GETs
+
+Added with a constant server default so SQLite can add the NOT NULL column in place, without
+rebuilding pattern (dropping it would cascade into section). Posts start at their publish date,
+patterns and sections at the time of the upgrade.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+TABLES = ('post', 'pattern', 'section')
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for name in TABLES:
+        if 'updated_at' in {c['name'] for c in inspector.get_columns(name)}:
+            continue  # made by db.create_all()
+        op.add_column(name, sa.Column('updated_at', sa.DateTime(), nullable=False,
+                                      server_default='1970-01-01 00:00:00'))
+        table = sa.table(name, sa.column('updated_at'), sa.column('date_posted'))
+        if name == 'post':
+            op.execute(table.update().values(updated_at=table.c.date_posted))
+        else:
+            op.execute(table.update().values(updated_at=sa.func.now()))
+
+
+def downgrade():
+    for name in TABLES:  # plain ALTER TABLE (SQLite 3.35+): a batch rebuild of pattern would cascade into section
+        op.drop_column(name, 'updated_at')
@@ -0,0 +1,38 @@
+"""content_html and content_html_version on post, pattern and section
+
+Markdown is rendered and sanitised when content is written, and the html is stored next to it.
+Existing rows start empty: run `flask content rerender` after upgrading, until then their text is
+shown escaped as before.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 12:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+TABLES = ('post', 'pattern', 'section')
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for name in TABLES:
+        existing = {c['name'] for c in inspector.get_columns(name)}
+        if 'content_html' not in existing:  # nullable, so sqlite adds them in place
+            op.add_column(name, sa.Column('content_html', sa.Text(), nullable=True))
+        if 'content_html_version' not in existing:
+            op.add_column(name, sa.Column('content_html_version', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    for name in TABLES:  # plain ALTER TABLE (SQLite 3.35+): a batch rebuild of pattern would cascade into section
+        op.drop_column(name, 'content_html_version')
+        op.drop_column(name, 'content_html')
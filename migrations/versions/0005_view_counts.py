@@ -0,0 +1,33 @@
+"""views on post and pattern, with indexes for the most viewed listing
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+TABLES = ('post', 'pattern')
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for name in TABLES:
+        if 'views' not in {c['name'] for c in inspector.get_columns(name)}:  # not made by db.create_all()
+            op.add_column(name, sa.Column('views', sa.Integer(), nullable=False, server_default='0'))
+        if f'ix_{name}_views_id' not in {i['name'] for i in inspector.get_indexes(name)}:
+            op.create_index(f'ix_{name}_views_id', name, ['views', 'id'])
+
+
+def downgrade():
+    for name in TABLES:  # plain ALTER TABLE (SQLite 3.35+): a batch rebuild of pattern would cascade into section
+        op.drop_index(f'ix_{name}_views_id', table_name=name)
+        op.drop_column(name, 'views')
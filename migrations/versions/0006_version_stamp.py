@@ -0,0 +1,31 @@
+"""version_stamp table, polled by workers holding a snapshot of the pattern catalogue
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if 'version_stamp' not in sa.inspect(op.get_bind()).get_table_names():  # not made by db.create_all()
+        op.create_table('version_stamp',
+                        sa.Column('name', sa.String(length=50), nullable=False),
+                        sa.Column('version', sa.Integer(), nullable=False),
+                        sa.PrimaryKeyConstraint('name'))
+    stamp = sa.table('version_stamp', sa.column('name', sa.String), sa.column('version', sa.Integer))
+    if not op.get_bind().execute(sa.select([stamp.c.name]).where(stamp.c.name == 'patterns')).first():
+        op.bulk_insert(stamp, [{'name': 'patterns', 'version': 1}])
+
+
+def downgrade():
+    op.drop_table('version_stamp')
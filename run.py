@@ -1,6 +1,14 @@
 from flaskblog import create_app
 
-app = create_app()
+
+def __getattr__(name):  # `app` is built on first use: spawned avatar workers re-import this module and don't need it
+    if name == 'app':
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
 
 if __name__ == '__main__':  # debug=True when we run the script directly. Lets us update the page w/o restarting webapp.
+    app = create_app()
     app.run(debug=True)